@@ -43,6 +43,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'tcms.middleware.CMSMiddleware',
 )
 
 ROOT_URLCONF = 'example.urls'
@@ -24,6 +24,7 @@ class Img(Section):
     NAME = 'Single image, outputs img tag'
     DESCRIPTION = 'Single image content, outputs img tag'
     template = 'tcms/image.html'
+    CACHE_TIMEOUT = 60 * 60 # cached by {% cms_section %} tag
 
     def set_fields(self):
         self['image'] = Value(image=Image(), title=Text(),
@@ -20,6 +20,7 @@ urlpatterns = patterns('',
     url(r'^$', direct_to_template, {'template': 'testpage.html'}),
 
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^api/', include('tcms.urls')),
     url(r'^media/(?P<path>.*)$', 'django.views.static.serve',
         {'document_root':  join(dirname(__file__), 'media')},
         name='media'),
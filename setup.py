@@ -31,6 +31,8 @@ setup(name='django-tcms',
       keywords='django, cms, django-admin',
       url='https://github.com/omab/django-tcms',
       packages=['tcms',
+                'tcms.management',
+                'tcms.management.commands',
                 'tcms.templatetags'],
       package_data={
           'tcms': [
@@ -46,7 +48,7 @@ setup(name='django-tcms',
           ]
       },
       long_description=long_description(),
-      install_requires=['django>=1.2.5'],
+      install_requires=['django>=1.3'],
       classifiers=['Framework :: Django',
                    'Development Status :: 4 - Beta',
                    'Topic :: Internet',
@@ -1,24 +1,83 @@
 # -*- coding: utf-8 -*-
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.core.exceptions import ValidationError
 from django.contrib import admin
 from django.http import HttpResponseRedirect
 from django.conf.urls.defaults import url, patterns
 from django.contrib.admin.filterspecs import ChoicesFilterSpec, RelatedFilterSpec
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.db.models import Q
 from django.utils.encoding import smart_unicode
 from django.views.generic.simple import redirect_to
 
 from tcms import views
-from tcms.models import Path, Page, Value
-from tcms.utils import update_cache
+from tcms.models import Path, Page, Value, Job, Release, ReleaseItem, \
+                        SharedSection
+from tcms.search import search_values, search_pages
+from tcms.utils import update_cache, normalize_path
+
+
+# max results for admin searches
+ADMIN_SEARCH_LIMIT = getattr(settings, 'TCMS_ADMIN_SEARCH_LIMIT', 500)
+
+
+# keyset cursor of admin searches results
+AFTER_VAR = 'after'
+
+
+class IndexedChangeList(ChangeList):
+    """Change list that searches through model admin indexed_search method
+    instead of search_fields LIKE queries, search_fields are kept to show
+    the search box.
+
+    indexed_search gets the cursor of the results to show from after
+    parameter and returns the filtered queryset, the cursor of the next
+    results (if any) and whether results were truncated."""
+    search_truncated = False
+    search_next_url = None
+
+    def get_query_set(self):
+        query, self.query = self.query, ''
+        after = self.params.pop(AFTER_VAR, None)
+        try:
+            qs = super(IndexedChangeList, self).get_query_set()
+        finally:
+            self.query = query
+            if after is not None:
+                self.params[AFTER_VAR] = after
+        if query:
+            qs, next_after, self.search_truncated = \
+                    self.model_admin.indexed_search(qs, query, after)
+            if next_after is not None:
+                self.search_next_url = self.get_query_string(
+                                                {AFTER_VAR: next_after},
+                                                [PAGE_VAR])
+        return qs
 
 
 class ValueOptions(admin.ModelAdmin):
     list_display = ('id', 'page', 'name', 'type')
+    change_list_template = 'cms/value_change_list.html'
     search_fields = ('name', 'value')
     list_filter = ('type',)
     raw_id_fields = ('page',)
 
+    def get_changelist(self, request, **kwargs):
+        return IndexedChangeList
+
+    def indexed_search(self, qs, query, after=None):
+        """Values containing query phrase or named as query, matches are
+        paginated by keyset in ADMIN_SEARCH_LIMIT windows"""
+        try:
+            after = int(after) if after else None
+        except ValueError:
+            after = None
+        ids = search_values(query, after=after, limit=ADMIN_SEARCH_LIMIT)
+        truncated = len(ids) == ADMIN_SEARCH_LIMIT
+        return qs.filter(Q(pk__in=ids) | Q(name=query.strip())), \
+               ids[-1] if truncated else None, truncated
+
 
 class PathOptions(admin.ModelAdmin):
     list_display = ('id', 'path') + (('locale',) if settings.TCMS_LOCALIZED else ())
@@ -27,6 +86,63 @@ class PathOptions(admin.ModelAdmin):
     exclude = ('locale',) if not settings.TCMS_LOCALIZED else ()
 
 
+class JobOptions(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'page', 'state', 'progress', 'attempts',
+                    'run_after', 'updated')
+    list_filter = ('kind', 'state')
+    raw_id_fields = ('page',)
+
+
+class ReleaseItemInline(admin.TabularInline):
+    model = ReleaseItem
+    raw_id_fields = ('page',)
+    readonly_fields = ('replaced',)
+    extra = 3
+
+
+class ReleaseOptions(admin.ModelAdmin):
+    list_display = ('id', 'name', 'state', 'created', 'released')
+    list_filter = ('state',)
+    search_fields = ('name', 'description')
+    inlines = (ReleaseItemInline,)
+    actions = ('publish_releases', 'rollback_releases')
+
+    def publish_releases(self, request, queryset):
+        """Publish selected releases, each one rebuilds cache once"""
+        self._run(request, queryset, 'publish', 'published')
+    publish_releases.short_description = 'Publish selected releases'
+
+    def rollback_releases(self, request, queryset):
+        """Roll back selected releases"""
+        self._run(request, queryset, 'rollback', 'rolled back')
+    rollback_releases.short_description = 'Roll back selected releases'
+
+    def _run(self, request, queryset, method, done):
+        for release in queryset:
+            try:
+                getattr(release, method)()
+            except ValidationError, e:
+                self.message_user(request, '; '.join(e.messages))
+            else:
+                self.message_user(request, 'Release %s %s' % (release, done))
+
+
+class SharedSectionOptions(admin.ModelAdmin):
+    """Shared sections content is edited from any page including them"""
+    list_display = ('id', 'name', 'section', 'updated')
+    search_fields = ('name',)
+    readonly_fields = ('section', 'rendered')
+    actions = ('refresh_sections',)
+
+    def refresh_sections(self, request, queryset):
+        """Render selected shared sections again"""
+        for shared in queryset:
+            shared.refresh()
+        self.message_user(request, '%d shared sections refreshed' % \
+                                                        len(queryset))
+    refresh_sections.short_description = 'Refresh selected shared sections'
+
+
 class LocaleFilterSpec(RelatedFilterSpec):
     """Path locale filter spec"""
     def __init__(self, req, admin):
@@ -84,6 +200,17 @@ class PageOptions(admin.ModelAdmin):
     object_history_template = 'cms/page_history.html'
     ordering = ('-id', 'path__path', 'state')
 
+    def get_changelist(self, request, **kwargs):
+        return IndexedChangeList
+
+    def indexed_search(self, qs, query, after=None):
+        """Pages containing query phrase in values or description, or which
+        URL is the query. Matches are limited to ADMIN_SEARCH_LIMIT."""
+        ids = search_pages(query, limit=ADMIN_SEARCH_LIMIT)
+        return qs.filter(Q(pk__in=ids) |
+                         Q(path__path=normalize_path(query))), \
+               None, len(ids) >= ADMIN_SEARCH_LIMIT
+
     def lookup_allowed(self, key, value):
         """Validate lookup rule, check if path is given and allow it"""
         return key.startswith('path') or \
@@ -158,3 +285,6 @@ class PageOptions(admin.ModelAdmin):
 admin.site.register(Path, PathOptions)
 admin.site.register(Page, PageOptions)
 admin.site.register(Value, ValueOptions)
+admin.site.register(Job, JobOptions)
+admin.site.register(Release, ReleaseOptions)
+admin.site.register(SharedSection, SharedSectionOptions)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Read only JSON delivery of live pages for non Django frontends.
+
+Live pages snapshots are serialized when pages are published or refreshed
+and kept in cache, each field is stored as a ready to write JSON fragment
+so responses are joined from a single cache read. Shared sections are left
+out of snapshots and added from their own cache since they change without
+pages being published."""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseBadRequest, \
+                        HttpResponseNotModified, Http404
+from django.utils import simplejson
+from django.views.decorators.http import require_GET
+
+from tcms.utils import CACHE_NAME, id_from_cache
+
+
+# page fields delivered as page metadata
+META_FIELDS = ('path', 'locale', 'template', 'meta_title', 'meta_description',
+               'meta_keywords', 'search_text')
+SECTIONS, VALUES = 'sections', 'values'
+DEFAULT_FIELDS = META_FIELDS + (SECTIONS,)
+# seconds snapshots are cached, they are replaced on publish and refresh
+SNAPSHOT_TIMEOUT = getattr(settings, 'TCMS_SNAPSHOT_TIMEOUT',
+                           60 * 60 * 24 * 30)
+
+
+def build(page):
+    """Return @page snapshot, a dictionary with meta, sections and values
+    dictionaries of JSON fragments, shared sections names and an etag of
+    the content. Values are serialized by their types to_json method."""
+    from tcms.models import TYPES_MAP
+
+    meta = {'path': page.path.path, 'locale': page.path.locale,
+            'template': page.template, 'meta_title': page.meta_title,
+            'meta_description': page.meta_description,
+            'meta_keywords': page.meta_keywords,
+            'search_text': page.search_text}
+    values = {}
+    for name, type, value in page.effective_values():
+        if type in TYPES_MAP:
+            value = TYPES_MAP[type]().to_json(value)
+        values[name] = {'type': type, 'value': value}
+    snapshot = {
+        'meta': _fragments(meta),
+        SECTIONS: _fragments(dict(page.active_rendered()\
+                                      .values_list('name', 'value'))),
+        VALUES: _fragments(values),
+        'shared': page.tpl.shared_sections()
+    }
+    sha = hashlib.sha1(str(page.rendered_version))
+    for group in ('meta', SECTIONS, VALUES):
+        for name in sorted(snapshot[group]):
+            sha.update(snapshot[group][name].encode('utf-8'))
+    snapshot['etag'] = sha.hexdigest()
+    return snapshot
+
+
+def update(page):
+    """Store @page snapshot if it's live or drop it otherwise"""
+    if page.is_live:
+        cache.set(_key(page.id), build(page), SNAPSHOT_TIMEOUT)
+    else:
+        cache.delete(_key(page.id))
+
+
+def snapshot(page_id):
+    """Return snapshot of live page @page_id, None if it's not live. Missing
+    snapshots are built and stored."""
+    from tcms.models import Page
+
+    value = cache.get(_key(page_id))
+    if value is None:
+        try:
+            page = Page.objects.select_related('path').get(pk=page_id)
+        except Page.DoesNotExist:
+            return None
+        if not page.is_live:
+            return None
+        value = build(page)
+        cache.set(_key(page_id), value, SNAPSHOT_TIMEOUT)
+    return value
+
+
+def parse_fields(value):
+    """Return (meta names, sections names, values names) selected by a
+    comma separated @value. Groups are selected as a whole by their name or
+    partially by dotted names like sections.heading, None selects every
+    name in group and an empty tuple none of them."""
+    meta, groups = [], {SECTIONS: (), VALUES: ()}
+    for field in (value.split(',') if value else DEFAULT_FIELDS):
+        field = field.strip()
+        group, dot, name = field.partition('.')
+        if field in META_FIELDS:
+            meta.append(field)
+        elif group in groups and not dot:
+            groups[group] = None
+        elif group in groups and name:
+            if groups[group] is not None:
+                groups[group] += (name,)
+        else:
+            raise ValueError('Unknown field "%s"' % field)
+    return meta, groups[SECTIONS], groups[VALUES]
+
+
+@require_GET
+def page(request):
+    """Return JSON content of live page at path GET parameter for locale
+    parameter (or request language). Fields are selected by fields
+    parameter (see parse_fields), metadata and rendered sections are
+    returned by default. Responses carry an ETag and If-None-Match requests
+    are answered with 304 responses."""
+    path = request.GET.get('path')
+    if not path:
+        return HttpResponseBadRequest('Missing path parameter')
+    try:
+        meta, sections, values = parse_fields(request.GET.get('fields'))
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+
+    locale = request.GET.get('locale') or getattr(request, 'LANGUAGE_CODE',
+                                                  None)
+    page_id = id_from_cache([path], locale)
+    data = snapshot(page_id) if page_id is not None else None
+    if data is None:
+        raise Http404
+
+    shared = _shared(data, sections)
+    sha = hashlib.sha1(data['etag'])
+    sha.update(repr((meta, sections, values)))
+    for name in sorted(shared):
+        sha.update(shared[name].encode('utf-8'))
+    etag = '"%s"' % sha.hexdigest()
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        return HttpResponseNotModified()
+
+    parts = [data['meta'][name] for name in meta]
+    if sections != ():
+        content = dict(data[SECTIONS], **_fragments(shared))
+        parts.append('"%s":%s' % (SECTIONS, _group(content, sections)))
+    if values != ():
+        parts.append('"%s":%s' % (VALUES, _group(data[VALUES], values)))
+    response = HttpResponse(u'{%s}' % u','.join(parts),
+                            mimetype='application/json')
+    response['ETag'] = etag
+    return response
+
+
+def _shared(data, sections):
+    """Return current content of shared sections selected by @sections"""
+    from tcms.models import SharedSection
+
+    names = [name for name in data['shared']
+                if sections is None or name in sections]
+    return SharedSection.content(names) if names else {}
+
+
+def _group(fragments, names):
+    """Join @fragments selected by @names (all if None) in a JSON object"""
+    if names is None:
+        names = sorted(fragments)
+    return u'{%s}' % u','.join(fragments[name] for name in names
+                                    if name in fragments)
+
+
+def _fragments(values):
+    """Return dictionary of @values names and '"name":value' JSON pairs"""
+    return dict((name, u'%s:%s' % (simplejson.dumps(name),
+                                   simplejson.dumps(value)))
+                    for name, value in values.iteritems())
+
+
+def _key(page_id):
+    return '%s-snapshot-%s' % (CACHE_NAME, page_id)
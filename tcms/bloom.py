@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Bloom filter, a compact set membership structure. Lookups might give
+false positives but never false negatives."""
+import struct
+import hashlib
+from math import ceil, exp, log
+
+
+class BloomFilter(object):
+    """Bloom filter sized for @items and expected @error_rate"""
+    def __init__(self, items, error_rate=0.01):
+        items = list(items)
+        count = max(len(items), 1)
+        self.size = int(ceil(-count * log(error_rate) / (log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size * log(2) / count)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        for item in items:
+            self.add(item)
+
+    def _positions(self, item):
+        """Return bits positions for @item, positions are derived from two
+        halves of an md5 digest (double hashing)"""
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+        first, second = struct.unpack('<QQ', hashlib.md5(item).digest())
+        return [(first + pos * second) % self.size
+                    for pos in xrange(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7))
+                        for pos in self._positions(item))
+
+    def false_positive_rate(self):
+        """Return expected false positive rate for stored items"""
+        return (1 - exp(-self.hashes * self.count / float(self.size))) \
+                    ** self.hashes
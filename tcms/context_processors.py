@@ -7,7 +7,22 @@ from tcms.utils import id_from_cache
 
 def cms(request):
     """
-    Loads needed context data to render a CMS page.
+    Loads needed context data to render a CMS page, see page_for_request.
+
+    If request.no_cms is True then everything is skipped and no CMS data is
+    loaded.
+    """
+    if getattr(request, 'no_cms', False):
+        return {}
+    return {'cms': page_for_request(request)}
+
+
+def page_for_request(request):
+    """
+    Return CMS page for @request, None if there's no page for it. The page
+    is resolved once per request and kept in it, later calls (every
+    RequestContext or tcms.middleware.CMSMiddleware request.cms attribute)
+    reuse it.
 
     Raw values will be used if running in an instance with admin option
     enabled, if not, rendered content will be used instead.
@@ -23,13 +38,14 @@ def cms(request):
     override for current request path when looking for pages. If it's a list,
     then each path is tested until the first match and finally current path
     is tested.
-
-    If request.no_cms is True then everything is skipped and no CMS data is
-    loaded.
     """
-    if getattr(request, 'no_cms', False):
-        return {}
+    if not hasattr(request, '_cms_page'):
+        request._cms_page = _resolve(request)
+    return request._cms_page
+
 
+def _resolve(request):
+    """Look up and load CMS page for @request"""
     is_admin = 'django.contrib.admin' in settings.INSTALLED_APPS
 
     if is_admin and request.GET.get(CMSID):
@@ -47,12 +63,12 @@ def cms(request):
 
         cmsid = id_from_cache(paths, getattr(request, 'LANGUAGE_CODE', None))
 
-    ctx = {'cms': None}
+    page = None
     if cmsid is not None:
         try:
-            ctx['cms'] = Page.objects.select_related('path').get(pk=cmsid)
+            page = Page.objects.select_related('path').get(pk=cmsid)
         except Page.DoesNotExist: # shouldn't happen
             pass
         else:
-            ctx['cms'].load(rendered=not is_admin)
-    return ctx
+            page.load(rendered=not is_admin)
+    return page
@@ -4,14 +4,20 @@ Page template data types definitions. Here are defined custom data types
 with it's corresponding behavior to interact with the CMS. Project models
 can be added and will work in a raw_id way.
 """
+import base64
+import hashlib
+
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models.fields.files import ImageFieldFile
 from django.forms import ChoiceField, BooleanField
 from django.utils.safestring import mark_safe
 from django.db.models.loading import get_model
 
-from tcms.utils import save_b64_image, image_to_b64
+from tcms.utils import save_b64_image, image_to_b64, save_hashed, \
+                       hashed_lookup, file_checksum, upload_root, IMAGES_HASHED
+from tcms.images import queue_variants
 from tcms.fields import RelatedWidget, AdminCharField, PreviewImageField, \
                         RichTexareaField, AdminDateField, AdminDateTimeField
 
@@ -56,6 +62,11 @@ class BaseType(object):
         """
         return {'value': value}
 
+    def to_json(self, value):
+        """Return value to be delivered as JSON by tcms.api, must be JSON
+        serializable. Return value by default."""
+        return value
+
     def from_xml(self, data):
         """Return value that was stored in a XML file. @data should be
         a dictionary with same format as returned by to_xml method.
@@ -195,6 +206,9 @@ class Flag(PlainType):
         parse t, True or 1 as True values and f, False, 0 as False ones."""
         return models.BooleanField().to_python(value)
 
+    def to_json(self, value):
+        return self.value(value)
+
 
 class Image(PlainType):
     """Image data type"""
@@ -208,32 +222,58 @@ class Image(PlainType):
             raise ValueError, 'missing value'
         data = form.files[name]
         obj = self._model() # hackish way to save file
-        obj.value.save(data.name, data, save=False) # use field value to save
-        return obj.value.name
+        if IMAGES_HASHED: # identical content resolves to the same file
+            value = save_hashed(data, data.name, obj.value.storage,
+                                upload_root(IMAGES_UPLOAD_TO))
+        else:
+            obj.value.save(data.name, data, save=False) # use field to save
+            value = obj.value.name
+        queue_variants(value)
+        return value
 
     def _model(self, value=None):
         """Returns a django model instance with a value field of ImageField type,
         handy to save or read image file. @value will be loaded as image value."""
         class _Model(models.Model):
-            value = models.ImageField(upload_to=IMAGES_UPLOAD_TO, blank=True)
+            value = VariantsImageField(upload_to=IMAGES_UPLOAD_TO, blank=True)
         return _Model(value=value)
 
     def to_xml(self, value):
         """Convert image data to be stored in a XML file, the image is enconded
-        in base64. Image name and enconded value are returned."""
+        in base64. Image name, enconded value and content checksum are
+        returned."""
         img = image_to_b64(self._model(value).value)
         if img is not None:
             name, value = img
-            return {'file_name': name, 'value': value}
+            checksum = hashlib.sha1(base64.decodestring(value)).hexdigest()
+            return {'file_name': name, 'value': value, 'checksum': checksum}
         else:
             return {'value': value}
 
+    def to_json(self, value):
+        """Return image URL"""
+        img = self.value(value)
+        return img.url if img else None
+
+    def checksum(self, value):
+        """Return image content checksum"""
+        return file_checksum(self._model(value).value)
+
     def from_xml(self, data):
         """Reads image stored in a XML file, value must be an base64 enconded
-        image and name must be present."""
+        image and name must be present. Images exported without content
+        are looked up by checksum in local storage."""
         if 'value' in data and 'file_name' in data:
-            return save_b64_image(data['value'], data['file_name'],
-                                  self._model().value)
+            value = save_b64_image(data['value'], data['file_name'],
+                                   self._model().value)
+        elif 'checksum' in data:
+            value = hashed_lookup(data['checksum'], data.get('value'),
+                                  self._model().value.storage,
+                                  upload_root(IMAGES_UPLOAD_TO))
+        else:
+            return
+        queue_variants(value)
+        return value
 
     def value(self, value):
         """Return image value as a model would return it"""
@@ -242,6 +282,33 @@ class Image(PlainType):
             return img
 
 
+class VariantsFieldFile(ImageFieldFile):
+    """Image file with access to it's responsive width variants"""
+    @property
+    def variants(self):
+        """Return list of (width, url) pairs of generated variants, the
+        original image is included. Empty if variants weren't generated."""
+        from tcms.models import ImageVariant
+        if not hasattr(self, '_variants'):
+            qs = ImageVariant.objects.filter(original=self.name)\
+                                     .order_by('width')\
+                                     .values_list('width', 'name')
+            self._variants = [(width, self.storage.url(name))
+                                    for width, name in qs]
+        return self._variants
+
+    @property
+    def srcset(self):
+        """Return variants formatted for img srcset attribute"""
+        return ', '.join('%s %dw' % (url, width)
+                            for width, url in self.variants)
+
+
+class VariantsImageField(models.ImageField):
+    """ImageField which files give access to responsive variants"""
+    attr_class = VariantsFieldFile
+
+
 class Date(PlainType):
     """Date data type"""
     description = 'Date'
@@ -251,6 +318,11 @@ class Date(PlainType):
         """Return date instance"""
         return models.DateField().to_python(value)
 
+    def to_json(self, value):
+        """Return date in ISO format"""
+        value = self.value(value or None)
+        return value.isoformat() if value else None
+
 
 class DateTime(PlainType):
     """Datetime data type"""
@@ -261,6 +333,11 @@ class DateTime(PlainType):
         """Return date instance"""
         return models.DateTimeField().to_python(value)
 
+    def to_json(self, value):
+        """Return datetime in ISO format"""
+        value = self.value(value or None)
+        return value.isoformat() if value else None
+
 
 # Base types definition
 BASE_TYPES = [Text, BigText, Image, Option, Flag, Date, DateTime]
@@ -2,7 +2,7 @@
 from django import forms
 from django.contrib.admin.widgets import AdminFileWidget
 
-from tcms.models import Page, Path, Value, WIP
+from tcms.models import Page, Path, WIP
 from tcms.tpl import mkbasename
 from tcms.fields import PathWidget, AdminTexareaField, AdminCharField
 
@@ -16,6 +16,10 @@ class PageForm(forms.ModelForm):
     meta_title = AdminCharField(label='Title', required=False)
     meta_keywords = AdminCharField(label='Keywords', required=False)
     meta_description = AdminTexareaField(label='Description', required=False)
+    publish_at = forms.DateTimeField(label='Publish at', required=False,
+                                     help_text='YYYY-MM-DD HH:MM')
+    unpublish_at = forms.DateTimeField(label='Unpublish at', required=False,
+                                       help_text='YYYY-MM-DD HH:MM')
 
     def clean_path(self):
         """Path cleaning"""
@@ -42,7 +46,8 @@ class PageForm(forms.ModelForm):
 
     class Meta:
         model = Page
-        exclude = ('template', 'state', 'updated')
+        exclude = ('template', 'state', 'updated', 'rendered_version',
+                   'last_version')
 
 
 class CopyPageForm(forms.ModelForm):
@@ -101,29 +106,38 @@ class DynamicForm(forms.Form):
     def save(self, page):
         """Save method. Will save each section value.
         Will return saved values"""
-        result = []
+        result, values = [], []
         basename = self.cleaned_data['basename']
 
         for name, type in self.names:
             try: # use type save handler
-                value = type.to_database(self, name)
+                values.append((mkbasename(basename, name), type,
+                               type.to_database(self, name)))
             except ValueError: # ignore error
                 pass
-            else:
-                vname = mkbasename(basename, name)
-                try: # try to update a Value instance
-                    obj = page.values.get(name=vname)
-                    # if types are different, like it was changed in page
-                    # definition, needs to be overriden to avoid duplications
-                    # because of uniqueness definition on Value model
-                    if obj.type != type.name():
-                        obj.type = type.name()
-                    obj.value = value
-                    obj.save()
-                except Value.DoesNotExist: # save new value
-                    obj = page.values.create(name=vname, type=type.name(),
-                                             value=value)
-                result.append(obj)
+
+        if isinstance(page, Page): # copies keep seeing current values
+            page.detach_derived([(vname, type.name())
+                                    for vname, type, value in values])
+
+        for vname, type, value in values:
+            try: # try to update a Value instance
+                obj = page.values.get(name=vname)
+                # if types are different, like it was changed in page
+                # definition, needs to be overriden to avoid duplications
+                # because of uniqueness definition on Value model
+                if obj.type != type.name():
+                    obj.type = type.name()
+                obj.value = value
+                obj.cleared = False
+                obj.save()
+            except page.values.model.DoesNotExist: # save new value,
+                                # values inherited from a base page are
+                                # never modified, page might be a shared
+                                # section with SharedValue values
+                obj = page.values.create(name=vname, type=type.name(),
+                                         value=value)
+            result.append(obj)
         return result
 
 
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Responsive image variants. Configured width variants are generated for CMS
+images off the request path by a local worker pool, their names are stored
+in ImageVariant entries keyed by the original image name.
+"""
+import logging
+from os.path import splitext
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.db import connection
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    try:
+        import Image as PILImage
+    except ImportError:
+        PILImage = None
+
+
+IMAGE_VARIANTS = sorted(getattr(settings, 'TCMS_IMAGE_VARIANTS', ()))
+IMAGE_WORKERS = getattr(settings, 'TCMS_IMAGE_WORKERS', 2)
+
+_pool = None
+logger = logging.getLogger('tcms.images')
+
+
+def variant_name(name, width):
+    """Return variant file name for image @name and @width"""
+    base, ext = splitext(name)
+    return '%s-%dw%s' % (base, width, ext)
+
+
+def generate_variants(name, storage=default_storage):
+    """Generates configured width variants for image @name, widths not
+    narrower than the original are skipped. Returns a list of (width, name)
+    pairs including the original image."""
+    source = PILImage.open(StringIO(storage.open(name).read()))
+    source_width, source_height = source.size
+    image = source
+    if source.mode not in ('RGB', 'RGBA', 'L'):
+        image = source.convert('RGBA' if 'transparency' in source.info
+                                      else 'RGB')
+
+    variants = []
+    for width in IMAGE_VARIANTS:
+        if width >= source_width:
+            break
+        vname = variant_name(name, width)
+        if not storage.exists(vname):
+            height = max(1, int(round(source_height * width /
+                                      float(source_width))))
+            out = StringIO()
+            image.resize((width, height), PILImage.ANTIALIAS)\
+                 .save(out, format=source.format)
+            vname = storage.save(vname, ContentFile(out.getvalue()))
+        variants.append((width, vname))
+    variants.append((source_width, name))
+    return variants
+
+
+def store_variants(name):
+    """Generate variants for image @name and store their names, does nothing
+    if variants were already stored."""
+    from tcms.models import ImageVariant
+    if not ImageVariant.objects.filter(original=name).exists():
+        for width, vname in generate_variants(name):
+            ImageVariant.objects.get_or_create(original=name, width=width,
+                                               defaults={'name': vname})
+
+
+def _store_variants_task(name):
+    """Worker pool task, errors are logged since nobody waits for the
+    result and the thread database connection is closed when done"""
+    try:
+        store_variants(name)
+    except Exception:
+        logger.exception('Variants generation failed for %s', name)
+    finally:
+        connection.close()
+
+
+def queue_variants(name):
+    """Schedule variants generation for image @name on the local worker
+    pool. Does nothing if no variants are configured or PIL is missing."""
+    global _pool
+    if not (name and IMAGE_VARIANTS and PILImage):
+        return
+    if _pool is None:
+        from multiprocessing.pool import ThreadPool
+        _pool = ThreadPool(IMAGE_WORKERS)
+    _pool.apply_async(_store_variants_task, (name,))
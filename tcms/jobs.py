@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Background jobs queue. Jobs are stored in Job model and run by
+tcms_worker management command, failed jobs are retried a few times
+before giving up and duplicated pending jobs for a page are coalesced.
+
+Scheduled publishing is run by tcms_scheduler management command, it
+records a job for each scheduled page it publishes or unpublishes."""
+import traceback
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from tcms.models import Page, Job, PUBLISH, UNPUBLISH, REFRESH, \
+                        UPDATE_CACHE, PENDING, RUNNING, DONE, FAILED, LIVE
+from tcms.utils import update_cache
+
+
+# run publish and refresh from admin in background
+BACKGROUND_PUBLISH = getattr(settings, 'TCMS_BACKGROUND_PUBLISH', False)
+# attempts before a job is marked as failed and seconds between them
+JOB_MAX_ATTEMPTS = getattr(settings, 'TCMS_JOB_MAX_ATTEMPTS', 3)
+JOB_RETRY_DELAY = getattr(settings, 'TCMS_JOB_RETRY_DELAY', 60)
+
+
+def enqueue(kind, page=None, run_after=None, sections=None):
+    """Queue a @kind job for @page to be run after @run_after (now by
+    default), refresh jobs can be limited to @sections names. A pending job
+    of the same kind for the page is reused."""
+    run_after = run_after or datetime.now()
+    sections = ' '.join(sorted(set(sections or ())))
+    try:
+        job = Job.objects.filter(kind=kind, page=page, state=PENDING)[0]
+    except IndexError:
+        job = Job.objects.create(kind=kind, page=page, run_after=run_after,
+                                 sections=sections)
+    else:
+        if run_after < job.run_after:
+            job.run_after = run_after
+        if not sections: # all sections
+            job.sections = ''
+        elif job.sections:
+            job.sections = ' '.join(sorted(set(job.sections.split()) |
+                                           set(sections.split())))
+        job.save()
+    transaction.commit_unless_managed()
+    return job
+
+
+def claim(now=None):
+    """Mark the next pending job as running and return it, None is returned
+    if there are no jobs due. Other due pending jobs of the same kind for
+    the same page are coalesced into the claimed one."""
+    now = now or datetime.now()
+    due = Job.objects.filter(state=PENDING, run_after__lte=now)
+    for job_id in due.values_list('id', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=job_id, state=PENDING)\
+                             .update(state=RUNNING, updated=now,
+                                     started=now,
+                                     attempts=F('attempts') + 1)
+        if claimed: # another worker didn't take it first
+            job = Job.objects.get(pk=job_id)
+            if not job.sections: # covers any other pending job for page
+                due.filter(kind=job.kind, page=job.page_id)\
+                   .update(state=DONE, updated=now,
+                           message='Coalesced into job %d' % job.id)
+            transaction.commit_unless_managed()
+            return job
+    transaction.commit_unless_managed()
+
+
+def run(job):
+    """Run claimed @job, returns True on success"""
+    try:
+        if job.kind == PUBLISH:
+            job.page.publish(progress=lambda done, total: \
+                                            set_progress(job, done, total))
+        elif job.kind == UNPUBLISH:
+            if job.page.state != LIVE:
+                _update(job, state=DONE, progress=100,
+                        message='Page is not live')
+                return True
+            job.page.unpublish()
+        elif job.kind == REFRESH:
+            job.page.refresh(sections=job.sections.split() or None,
+                             progress=lambda done, total: \
+                                            set_progress(job, done, total))
+        elif job.kind == UPDATE_CACHE:
+            update_cache()
+        else:
+            raise ValueError('Unknown job kind "%s"' % job.kind)
+    except Exception:
+        transaction.rollback_unless_managed()
+        fail(job, traceback.format_exc())
+        return False
+    else:
+        _update(job, state=DONE, progress=100, message='')
+        return True
+
+
+def run_scheduled(now=None, size=100):
+    """Publish and unpublish pages scheduled before @now in batches of
+    @size pages, routing cache is rebuilt once per batch. Pages are
+    published first, so pages which publish and unpublish times are both
+    due end unpublished. Only live pages are unpublished, the unpublish time
+    of other pages is kept until they are published. Returns the jobs
+    recorded."""
+    now = now or datetime.now()
+    jobs = []
+    for kind, field in ((PUBLISH, 'publish_at'), (UNPUBLISH, 'unpublish_at')):
+        while True:
+            due = Page.objects.filter(**{field + '__lte': now})
+            if kind == UNPUBLISH:
+                due = due.filter(state=LIVE)
+            due = list(due.order_by(field, 'id')\
+                          .values_list('id', field)[:size])
+            if not due:
+                break
+            try:
+                for page_id, scheduled in due:
+                    taken = _take_scheduled(kind, field, page_id, scheduled)
+                    if taken is None: # taken by another scheduler
+                        continue
+                    page, job = taken
+                    try:
+                        if kind == PUBLISH:
+                            page._publish()
+                        else:
+                            page._unpublish()
+                    except Exception:
+                        transaction.rollback_unless_managed()
+                        _update(job, state=FAILED,
+                                message=traceback.format_exc())
+                    else:
+                        _update(job, state=DONE, progress=100)
+                    jobs.append(job)
+            finally:
+                update_cache()
+            if len(due) < size:
+                break
+    return jobs
+
+
+def _take_scheduled(kind, field, page_id, scheduled):
+    """Take page @page_id clearing its @field time if it's still
+    @scheduled, so concurrent schedulers don't run it twice. A running job
+    due at scheduled time is recorded right before the page is run, so
+    tcms_worker retakes it if the scheduler dies. Returns (page, job) pair
+    or None if page was already taken."""
+    taken = Page.objects.filter(**{'pk': page_id, field: scheduled})\
+                        .update(**{field: None})
+    job = None
+    if taken:
+        job = Job.objects.create(kind=kind, page_id=page_id, state=RUNNING,
+                                 attempts=1, run_after=scheduled,
+                                 started=datetime.now())
+    transaction.commit_unless_managed()
+    if job is not None:
+        return Page.objects.select_related('path').get(pk=page_id), job
+
+
+def fail(job, message):
+    """Retry @job later or mark it as failed if it ran out of attempts"""
+    if job.attempts < JOB_MAX_ATTEMPTS:
+        delay = timedelta(seconds=JOB_RETRY_DELAY * job.attempts)
+        _update(job, state=PENDING, progress=0, message=message,
+                run_after=datetime.now() + delay)
+    else:
+        _update(job, state=FAILED, message=message)
+
+
+def set_progress(job, done, total):
+    """Store @job progress percent"""
+    _update(job, progress=done * 100 / max(total, 1))
+
+
+def requeue_stale(seconds):
+    """Return to the queue running jobs not updated in the last @seconds,
+    their worker is assumed dead. Jobs which ran out of attempts are marked
+    as failed instead. Returns number of jobs requeued and failed."""
+    limit = datetime.now() - timedelta(seconds=seconds)
+    stale = Job.objects.filter(state=RUNNING, updated__lt=limit)
+    failed = stale.filter(attempts__gte=JOB_MAX_ATTEMPTS)\
+                  .update(state=FAILED,
+                          message='Worker stalled on every attempt')
+    requeued = stale.update(state=PENDING, progress=0)
+    transaction.commit_unless_managed()
+    return requeued, failed
+
+
+def _update(job, **fields):
+    """Update @job @fields without saving the rest of the row"""
+    fields['updated'] = datetime.now()
+    Job.objects.filter(pk=job.id).update(**fields)
+    transaction.commit_unless_managed()
+    for name, value in fields.iteritems():
+        setattr(job, name, value)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from optparse import make_option
+
+from django.db.models import F
+from django.core.management.base import BaseCommand
+
+from tcms.models import Page, Rendered, LIVE, REFRESH
+from tcms.tpl import PAGES
+from tcms.jobs import enqueue
+from tcms.utils import iter_chunked
+
+
+class Command(BaseCommand):
+    """Compares live pages rendered sections fingerprints with the current
+    ones and queues refresh jobs for the stale or missing sections"""
+    help = 'Queue refresh of stale CMS rendered content'
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help='Report stale pages without '
+                                        'queueing refresh jobs'),
+    )
+
+    def handle(self, *args, **options):
+        expected, templates = {}, {}
+        seen, stale = defaultdict(set), defaultdict(set)
+        qs = Rendered.objects.filter(page__state=LIVE,
+                                     version=F('page__rendered_version'))
+        for page_id, template, name, fingerprint in \
+                iter_chunked(qs, ('page', 'page__template', 'name',
+                                  'fingerprint')):
+            if template not in expected:
+                expected[template] = PAGES[template]().fingerprints() \
+                                        if template in PAGES else {}
+            templates[page_id] = template
+            seen[page_id].add(name)
+            if name in expected[template] and \
+               expected[template][name] != fingerprint:
+                stale[page_id].add(name)
+
+        for page_id, names in seen.iteritems():
+            missing = set(expected[templates[page_id]]) - names
+            if missing:
+                stale[page_id].update(missing)
+
+        for page_id, names in sorted(stale.iteritems()):
+            if not options['dry_run']:
+                enqueue(REFRESH, Page(pk=page_id), sections=names)
+            self.stdout.write('Page %d: %s\n' % (page_id,
+                                                 ', '.join(sorted(names))))
+        self.stdout.write('%d of %d live pages %s\n' % \
+                                (len(stale), len(seen),
+                                 'are stale' if options['dry_run']
+                                             else 'queued for refresh'))
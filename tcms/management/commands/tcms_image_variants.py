@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tcms.models import Value, ImageVariant, TYPES_MAP
+from tcms.data_types import Image
+from tcms.images import store_variants, IMAGE_VARIANTS, PILImage
+from tcms.utils import iter_chunked
+
+
+class Command(BaseCommand):
+    """Generates missing responsive variants for images stored in values,
+    useful for images uploaded before variants were configured."""
+    help = 'Generate missing responsive variants for CMS images'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size',
+                    default=1000, help='Rows fetched per query'),
+    )
+
+    def handle(self, *args, **options):
+        if not IMAGE_VARIANTS or PILImage is None:
+            raise CommandError('TCMS_IMAGE_VARIANTS is not defined or PIL '
+                               'is not installed')
+        types = [name for name, Type in TYPES_MAP.iteritems()
+                        if issubclass(Type, Image)]
+        done, count = set(), 0
+        for name, in iter_chunked(Value.objects.filter(type__in=types),
+                                  ('value',), options['chunk_size']):
+            if not name or name in done:
+                continue
+            done.add(name)
+            if not ImageVariant.objects.filter(original=name).exists():
+                try:
+                    store_variants(name)
+                except IOError, e:
+                    self.stderr.write('%s: %s\n' % (name, e))
+                else:
+                    count += 1
+        self.stdout.write('Variants generated for %d images\n' % count)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.conf import settings
+from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+
+from tcms.models import Page, Value, Rendered, ContentTerm, SearchTerm, \
+                        ReleaseItem, OLD, RELEASED
+
+
+KEEP_OLD_PAGES = getattr(settings, 'TCMS_KEEP_OLD_PAGES', 5)
+
+
+class Command(BaseCommand):
+    """Retention policy for old pages. Keeps the newest OLD pages for each
+    URL and deletes the rest with their values and rendered content.
+    Uploaded images are left for tcms_sweep_media command."""
+    help = 'Purge OLD pages keeping the newest ones for each URL'
+    option_list = BaseCommand.option_list + (
+        make_option('--keep', type='int', dest='keep', default=KEEP_OLD_PAGES,
+                    help='OLD pages to keep per URL (default %d)' % \
+                                                            KEEP_OLD_PAGES),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=100, help='Pages deleted per transaction'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help='Report pages without deleting them'),
+    )
+
+    def handle(self, *args, **options):
+        keep, size = options['keep'], options['batch_size']
+        if keep < 0 or size < 1:
+            raise CommandError('--keep cannot be negative and --batch-size '
+                               'must be greater than zero')
+
+        ids = self.candidates(keep)
+        total = len(ids)
+        action = 'Would purge' if options['dry_run'] else 'Purged'
+        for start in range(0, total, size):
+            batch = ids[start:start + size]
+            if not options['dry_run']:
+                self.purge(batch)
+            self.stdout.write('%s %d/%d OLD pages\n' % \
+                                        (action, start + len(batch), total))
+        if not total:
+            self.stdout.write('Nothing to purge\n')
+
+    def candidates(self, keep):
+        """Return OLD page ids beyond the @keep newest ones for each path,
+        pages replaced by published releases are kept for rollbacks"""
+        ids, current, count = [], None, 0
+        replaced = set(ReleaseItem.objects.filter(release__state=RELEASED,
+                                                  replaced__isnull=False)\
+                                          .values_list('replaced', flat=True))
+        qs = Page.objects.filter(state=OLD).order_by('path', '-id')\
+                                           .values_list('id', 'path')
+        for page_id, path_id in qs.iterator():
+            if page_id in replaced:
+                continue
+            if path_id != current:
+                current, count = path_id, 0
+            count += 1
+            if count > keep:
+                ids.append(page_id)
+        return ids
+
+    @transaction.commit_on_success
+    def purge(self, ids):
+        """Delete pages with @ids, values are handed down to pages based
+        on them first. Pages are fetched one at a time since releasing a
+        page rebases the pages derived from it, which might be in @ids
+        too."""
+        for page_id in list(Page.objects.filter(pk__in=ids,
+                                                derived__isnull=False)\
+                                        .distinct()\
+                                        .values_list('id', flat=True)):
+            Page.objects.get(pk=page_id).release_derived()
+        ContentTerm.objects.filter(page__in=ids).delete()
+        SearchTerm.objects.filter(page__in=ids).delete()
+        Rendered.objects.filter(page__in=ids).delete()
+        Value.objects.filter(page__in=ids).delete()
+        Page.objects.filter(pk__in=ids).delete()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from tcms.models import Page, Value, LIVE
+from tcms.search import index_page, index_value, index_description
+from tcms.utils import iter_chunked
+
+
+class Command(BaseCommand):
+    """Rebuilds search index entries for every live page, and content
+    index entries used by admin searches if requested"""
+    help = 'Rebuild CMS search index for live pages'
+    option_list = BaseCommand.option_list + (
+        make_option('--content', action='store_true', dest='content',
+                    default=False, help='Rebuild admin content index too'),
+    )
+
+    def handle(self, *args, **options):
+        ids = list(Page.objects.filter(state=LIVE).order_by('id')\
+                               .values_list('id', flat=True))
+        for pos, page_id in enumerate(ids):
+            index_page(Page.objects.select_related('path').get(pk=page_id))
+            if (pos + 1) % 100 == 0:
+                self.stdout.write('%d/%d pages indexed\n' % (pos + 1,
+                                                            len(ids)))
+        self.stdout.write('%d pages indexed\n' % len(ids))
+
+        if options['content']:
+            count = 0
+            for value_id, page_id, value, cleared in \
+                    iter_chunked(Value.objects.all(),
+                                 ('id', 'page', 'value', 'cleared')):
+                index_value(Value(id=value_id, page_id=page_id, value=value,
+                                  cleared=cleared))
+                count += 1
+                if count % 1000 == 0:
+                    self.stdout.write('%d values indexed\n' % count)
+            for page_id, description in \
+                    iter_chunked(Page.objects.exclude(description=''),
+                                 ('id', 'description')):
+                index_description(Page(id=page_id, description=description))
+            self.stdout.write('%d values indexed\n' % count)
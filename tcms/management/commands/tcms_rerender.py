@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import time
+import traceback
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+
+from tcms.models import Page, LIVE
+
+
+class Command(BaseCommand):
+    """Re-renders live pages in a pool of processes, useful after deploys
+    changing sections templates or RENDER_EXTRA_CONTEXT"""
+    help = 'Re-render live CMS pages'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+                    default=cpu_count(),
+                    help='Worker processes (default %d)' % cpu_count()),
+        make_option('--template', dest='template', default=None,
+                    help='Only pages using this template'),
+        make_option('--path', dest='path', default=None,
+                    help='Only pages which URL starts with this path'),
+        make_option('--locale', dest='locale', default=None,
+                    help='Only pages with this locale'),
+        make_option('--slowest', type='int', dest='slowest', default=10,
+                    help='Slowest pages reported (default 10)'),
+    )
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be greater than zero')
+
+        qs = Page.objects.filter(state=LIVE)
+        if options['template']:
+            qs = qs.filter(template=options['template'])
+        if options['path']:
+            qs = qs.filter(path__path__startswith=options['path'])
+        if options['locale'] is not None:
+            qs = qs.filter(path__locale=options['locale'])
+        ids = list(qs.order_by('id').values_list('id', flat=True))
+        total = len(ids)
+
+        connection.close() # don't share parent connection with workers
+        pool = Pool(options['processes'], initializer=_init)
+        chunk = max(1, total / (options['processes'] * 20))
+        start, timings, failed = time.time(), [], 0
+        try:
+            results = pool.imap_unordered(_rerender, ids, chunk)
+            for pos, (page_id, path, seconds, error) in enumerate(results):
+                if error:
+                    failed += 1
+                    self.stderr.write('Page %d failed:\n%s\n' % (page_id,
+                                                                 error))
+                else:
+                    timings.append((seconds, page_id, path))
+                if (pos + 1) % 100 == 0:
+                    self.stdout.write('%d/%d pages rendered\n' % (pos + 1,
+                                                                  total))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        elapsed = time.time() - start
+        self.stdout.write('%d pages rendered, %d failed in %.2fs '
+                          '(%.2f pages/s)\n' % \
+                                (len(timings), failed, elapsed,
+                                 len(timings) / elapsed if elapsed else 0))
+        timings.sort(reverse=True)
+        for seconds, page_id, path in timings[:options['slowest']]:
+            self.stdout.write('  %.3fs page %d %s\n' % (seconds, page_id,
+                                                        path))
+
+
+def _init():
+    """Worker initializer, each worker opens its own connection"""
+    connection.close()
+
+
+def _rerender(page_id):
+    """Refresh rendered content of page @page_id, returns page id, path,
+    seconds taken and error traceback if any"""
+    start = time.time()
+    try:
+        page = Page.objects.select_related('path').get(pk=page_id)
+        page.refresh()
+    except Exception:
+        return page_id, None, time.time() - start, traceback.format_exc()
+    return page_id, page.path.path, time.time() - start, None
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import time
+from optparse import make_option
+
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+
+from tcms.jobs import run_scheduled
+
+
+class Command(BaseCommand):
+    """Publishes and unpublishes pages at their scheduled time"""
+    help = 'Run CMS scheduled publishing'
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', dest='once',
+                    default=False, help='Run due pages and exit'),
+        make_option('--sleep', type='int', dest='sleep', default=30,
+                    help='Seconds between checks (default 30)'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=100,
+                    help='Pages published per cache rebuild (default 100)'),
+    )
+
+    def handle(self, *args, **options):
+        if options['sleep'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--sleep and --batch-size must be greater '
+                               'than zero')
+
+        while True:
+            for job in run_scheduled(size=options['batch_size']):
+                self.stdout.write('%s page %d %s, %ds late\n' % \
+                                    (job.get_kind_display(), job.page_id,
+                                     job.state, job.lateness))
+            if options['once']:
+                break
+            connection.close()
+            time.sleep(options['sleep'])
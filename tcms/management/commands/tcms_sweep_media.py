@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import time
+from os.path import join
+from optparse import make_option
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from tcms.models import Page, Value, SharedValue, ImageVariant, \
+                        TYPES_MAP, IMAGES_UPLOAD_TO
+from tcms.data_types import Image
+from tcms.utils import upload_root, iter_chunked
+
+
+class Command(BaseCommand):
+    """Orphaned media sweeper. Collects image names referenced by values,
+    shared sections values and pages search images (and their responsive
+    variants), then walks the CMS images directory and deletes (or moves to
+    a quarantine directory) the files not referenced.
+    """
+    help = 'Delete or quarantine CMS images not referenced by any page'
+    option_list = BaseCommand.option_list + (
+        make_option('--quarantine', dest='quarantine', default=None,
+                    help='Move orphaned files under this storage directory '
+                         'instead of deleting them'),
+        make_option('--min-age', type='int', dest='min_age', default=24,
+                    help='Skip files modified in the last hours, protects '
+                         'uploads done while sweeping (default 24)'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+                    default=1000, help='Rows fetched per query'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help='Report files without removing them'),
+    )
+
+    def handle(self, *args, **options):
+        root = upload_root(IMAGES_UPLOAD_TO)
+        if not root:
+            raise CommandError('TCMS_IMAGES_UPLOAD_TO has no static directory '
+                               'to sweep')
+        quarantine = options['quarantine']
+        if quarantine and (quarantine.strip('/') == root or
+                           quarantine.strip('/').startswith(root + '/')):
+            raise CommandError('Quarantine directory cannot be inside %s' % \
+                                                                        root)
+
+        referenced = self.referenced(options['chunk_size'])
+        self.stdout.write('%d referenced images\n' % len(referenced))
+
+        limit = time.time() - options['min_age'] * 3600
+        seen = swept = 0
+        candidates = []
+        for name in self.walk(root):
+            seen += 1
+            if name in referenced or self.is_recent(name, limit):
+                continue
+            candidates.append(name)
+            if len(candidates) == options['chunk_size']:
+                swept += self.sweep(candidates, quarantine, options['dry_run'])
+                candidates = []
+                self.stdout.write('%d/%d files swept\n' % (swept, seen))
+        swept += self.sweep(candidates, quarantine, options['dry_run'])
+
+        action = 'would be swept' if options['dry_run'] else 'swept'
+        self.stdout.write('%d files checked, %d %s\n' % (seen, swept, action))
+
+    def sweep(self, names, quarantine, dry_run):
+        """Delete (or move to @quarantine) files in @names that are still
+        not referenced, returns number of files swept"""
+        used = self.still_referenced(names)
+        names = [name for name in names if name not in used]
+        if not dry_run:
+            for name in names:
+                if quarantine:
+                    default_storage.save(join(quarantine, name),
+                                         default_storage.open(name))
+                default_storage.delete(name)
+            ImageVariant.objects.filter(original__in=names).delete()
+        return len(names)
+
+    def referenced(self, size):
+        """Return set of image names referenced by values, shared sections
+        values and pages"""
+        types = [name for name, Type in TYPES_MAP.iteritems()
+                        if issubclass(Type, Image)]
+        names = set()
+        names.update(value for value, in
+                        iter_chunked(Value.objects.filter(type__in=types),
+                                     ('value',), size))
+        names.update(value for value, in
+                        iter_chunked(SharedValue.objects.filter(
+                                                        type__in=types),
+                                     ('value',), size))
+        names.update(image for image, in
+                        iter_chunked(Page.objects.exclude(search_image=''),
+                                     ('search_image',), size))
+        names.discard('')
+        names.update([name for original, name in
+                        iter_chunked(ImageVariant.objects.all(),
+                                     ('original', 'name'), size)
+                            if original in names])
+        return names
+
+    def walk(self, root):
+        """Yield file names under @root, one directory listed at a time"""
+        pending = [root]
+        while pending:
+            path = pending.pop()
+            dirs, files = default_storage.listdir(path)
+            pending.extend(join(path, name) for name in dirs)
+            for name in files:
+                yield join(path, name)
+
+    def still_referenced(self, names):
+        """Return set of @names (or originals of variants in them) that are
+        referenced now, they might have been reused by uploads since
+        referenced names were collected. A query is run per table for all
+        the names."""
+        if not names:
+            return set()
+        originals = dict(ImageVariant.objects.filter(name__in=names)\
+                                             .values_list('name', 'original'))
+        lookup = set(names) | set(originals.itervalues())
+        found = set(Value.objects.filter(value__in=lookup)\
+                                 .values_list('value', flat=True))
+        found.update(SharedValue.objects.filter(value__in=lookup)\
+                                        .values_list('value', flat=True))
+        found.update(Page.objects.filter(search_image__in=lookup)\
+                                 .values_list('search_image', flat=True))
+        return set(name for name in names
+                        if name in found or originals.get(name) in found)
+
+    def is_recent(self, name, limit):
+        """Return True if file @name was modified after @limit timestamp"""
+        try:
+            modified = default_storage.modified_time(name)
+        except NotImplementedError:
+            return False
+        return time.mktime(modified.timetuple()) > limit
+
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from tcms import navigation
+from tcms.models import Path
+from tcms.utils import update_cache, path_filter, PATH_FILTER_TTL, \
+                       WILDCARD_REST
+
+
+class Command(BaseCommand):
+    """Rebuilds CMS routing cache and reports it's size"""
+    help = 'Rebuild CMS routing cache'
+    option_list = BaseCommand.option_list + (
+        make_option('--rebuild-pointers', action='store_true',
+                    dest='rebuild_pointers', default=False,
+                    help='Recompute URLs live and WIP pages from pages '
+                         'states first'),
+        make_option('--navigation', action='store_true',
+                    dest='navigation', default=False,
+                    help='Rebuild navigation trees too'),
+    )
+
+    def handle(self, *args, **options):
+        if options['rebuild_pointers']:
+            Path.rebuild_pointers()
+        values = update_cache()
+        self.stdout.write('%d routes cached, %d patterns compiled\n' % \
+                                (len(values) - 1, _count(values[None])))
+        if PATH_FILTER_TTL:
+            paths, trie = path_filter()
+            self.stdout.write('Paths filter: %d paths, %d bytes, %d hashes, '
+                              '%.4f%% false positive rate\n' % \
+                                    (paths.count, len(paths.bits),
+                                     paths.hashes,
+                                     paths.false_positive_rate() * 100))
+        if options['navigation']:
+            locales = Path.objects.filter(live_page__isnull=False)\
+                                  .values_list('locale', flat=True)\
+                                  .distinct()
+            for locale in locales:
+                nodes = navigation.build(locale)
+                self.stdout.write('Navigation tree "%s": %d nodes\n' % \
+                                        (locale, len(nodes)))
+
+
+def _count(trie):
+    """Return number of patterns in @trie"""
+    return sum(1 if key is None or key == WILDCARD_REST else _count(node)
+                    for key, node in trie.iteritems())
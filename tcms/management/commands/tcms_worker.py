@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import time
+from optparse import make_option
+
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+
+from tcms.jobs import claim, run, requeue_stale
+
+
+class Command(BaseCommand):
+    """Runs queued background jobs (publish, refresh and cache updates)"""
+    help = 'Run queued CMS background jobs'
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', dest='once',
+                    default=False, help='Exit when the queue is empty'),
+        make_option('--sleep', type='int', dest='sleep', default=5,
+                    help='Seconds to wait for new jobs (default 5)'),
+        make_option('--stale', type='int', dest='stale', default=600,
+                    help='Seconds after which running jobs without '
+                         'progress are requeued (default 600)'),
+    )
+
+    def handle(self, *args, **options):
+        if options['sleep'] < 1 or options['stale'] < 1:
+            raise CommandError('--sleep and --stale must be greater than zero')
+
+        while True:
+            requeued, failed = requeue_stale(options['stale'])
+            if requeued or failed:
+                self.stdout.write('Requeued %d stale jobs, %d failed\n' % \
+                                        (requeued, failed))
+
+            job = claim()
+            if job is not None:
+                start = time.time()
+                ok = run(job)
+                self.stdout.write('Job %d %s (%s) %s in %.2fs\n' % \
+                                    (job.id, job.kind, job.page_id or '-',
+                                     'done' if ok else job.state,
+                                     time.time() - start))
+            elif options['once']:
+                break
+            else:
+                connection.close()
+                time.sleep(options['sleep'])
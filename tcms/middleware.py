@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from django.utils.functional import SimpleLazyObject
+
+from tcms.context_processors import page_for_request
+
+
+class LazyPage(SimpleLazyObject):
+    """Request CMS page resolved on first access, so views can still set
+    request.cms_url or request.no_cms before it's used. It's false if
+    there's no page for the request."""
+    def __nonzero__(self):
+        return bool(self._setupfunc())
+
+
+class CMSMiddleware(object):
+    """Attaches CMS page serving current request as request.cms. The page
+    is resolved once per request and shared with
+    tcms.context_processors.cms."""
+    def process_request(self, request):
+        request.cms = LazyPage(lambda: _page(request))
+        return None
+
+
+def _page(request):
+    if getattr(request, 'no_cms', False):
+        return None
+    return page_for_request(request)
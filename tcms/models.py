@@ -1,25 +1,48 @@
 # -*- coding: utf-8 -*-
 from urlparse import urljoin
+from datetime import datetime
 from xml.etree import ElementTree
 from operator import or_
+from collections import defaultdict
 
 from django.db import models, transaction
+from django.db.models import Max, F
 from django.db.models.query import Q
 from django.conf import settings
 from django.utils.xmlutils import SimplerXMLGenerator
 from django.utils.safestring import mark_safe
 from django.utils.importlib import import_module
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 
-from tcms.data_types import BASE_TYPES
-from tcms.tpl import PAGES, RENDER_EXTRA_CONTEXT
+from tcms.data_types import BASE_TYPES, Image
+from tcms.tpl import PAGES, RENDER_EXTRA_CONTEXT, SEP, split_basename
 from tcms.utils import save_b64_image, image_to_b64, update_cache, \
-                       normalize_path, dotted_dict_to_choices
+                       CACHE_NAME, \
+                       normalize_path, dotted_dict_to_choices, \
+                       file_checksum, hashed_lookup, upload_root, \
+                       is_pattern, insert_many
 
 
 # page states
 WIP, LIVE, OLD = ('wip', 'live', 'old')
 STATES = ((WIP, 'Work in Progress'), (LIVE, 'Live'), (OLD, 'Old page'))
+# Path fields pointing to the page in each state
+POINTERS = {WIP: 'wip_page', LIVE: 'live_page'}
+
+# release bundles states
+OPEN, RELEASED, ROLLED_BACK = ('open', 'released', 'rolled_back')
+RELEASE_STATES = ((OPEN, 'Open'), (RELEASED, 'Released'),
+                  (ROLLED_BACK, 'Rolled back'))
+
+# background jobs kinds and states
+PUBLISH, UNPUBLISH, REFRESH, UPDATE_CACHE = ('publish', 'unpublish',
+                                             'refresh', 'update_cache')
+JOB_KINDS = ((PUBLISH, 'Publish'), (UNPUBLISH, 'Unpublish'),
+             (REFRESH, 'Refresh content'), (UPDATE_CACHE, 'Update cache'))
+PENDING, RUNNING, DONE, FAILED = ('pending', 'running', 'done', 'failed')
+JOB_STATES = ((PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'),
+              (FAILED, 'Failed'))
 
 # Load extra data types
 EXTRA_TYPES_SETTINGS = getattr(settings, 'EXTRA_TYPES_SETTINGS', None)
@@ -38,19 +61,58 @@ TYPES_MAP = dict((Type.__name__.lower(), Type)
 CMSID = 'cmsid'
 IMAGES_UPLOAD_TO = getattr(settings, 'TCMS_IMAGES_UPLOAD_TO',
                            'cms/image/%Y/%m/%d')
+# copies deeper than this get their values materialized
+COPY_MAX_DEPTH = getattr(settings, 'TCMS_COPY_MAX_DEPTH', 10)
+
+
+def sections_filter(sections):
+    """Return Q filter for values and rendered content of @sections names,
+    None if no sections are given"""
+    if sections:
+        if not isinstance(sections, (list, tuple)):
+            sections = (sections,)
+        return reduce(or_, (Q(name__startswith=section)
+                                for section in sections))
+
+
+def resolve_values(lineage, rows):
+    """Return (name, type, value) triplets visible for a page with @lineage
+    from (page, name, type, value, cleared) @rows of pages in it. Values of
+    nearest pages win and cleared values are left out."""
+    rank = dict((page_id, pos) for pos, page_id in enumerate(lineage))
+    found = {}
+    for page_id, name, type, value, cleared in rows:
+        if name not in found or rank[page_id] < found[name][0]:
+            found[name] = (rank[page_id], type, value, cleared)
+    return [(name, type, value)
+                for name, (pos, type, value, cleared) in found.iteritems()
+                    if not cleared]
 
 
 class Path(models.Model):
-    """A CMS Page path."""
+    """A CMS Page path. Paths might be patterns with wildcard segments,
+    '*' matches any single segment and a trailing '**' matches the rest of
+    the requested path."""
     path = models.CharField(max_length=200)
     locale = models.CharField(max_length=255, blank=True, default='',
                               choices=settings.LANGUAGES)
+    # current live and work in progress pages, maintained on Page.save
+    live_page = models.ForeignKey('Page', null=True, blank=True,
+                                  editable=False, related_name='+',
+                                  on_delete=models.SET_NULL)
+    wip_page = models.ForeignKey('Page', null=True, blank=True,
+                                 editable=False, related_name='+',
+                                 on_delete=models.SET_NULL)
 
     def save(self, *args, **kwargs):
         """Save method. Enforces absolute paths."""
         self.path = normalize_path(self.path)
         super(Path, self).save(*args, **kwargs)
 
+    def is_pattern(self):
+        """Returns True if path has wildcard segments"""
+        return is_pattern(self.path)
+
     def full_url(self):
         """Returns path full url"""
         return urljoin(settings.SITE_URL, self.path)
@@ -58,10 +120,18 @@ class Path(models.Model):
     def live(self):
         """Returns current live Page for current instance path and
         locale values."""
-        try:
-            return self.pages.get(state=LIVE)
-        except Page.DoesNotExist:
-            pass
+        return self.live_page
+
+    @classmethod
+    @transaction.commit_on_success
+    def rebuild_pointers(cls):
+        """Recompute live and work in progress pages pointers from pages
+        states, needed to populate them on existing databases."""
+        cls.objects.update(live_page=None, wip_page=None)
+        for state, field in POINTERS.iteritems():
+            for path_id, page_id in Page.objects.filter(state=state)\
+                                                .values_list('path', 'id'):
+                cls.objects.filter(pk=path_id).update(**{field: page_id})
 
     def __unicode__(self):
         return self.path
@@ -74,6 +144,77 @@ class Path(models.Model):
         verbose_name = 'URL'
 
 
+class PageManager(models.Manager):
+    def load_many(self, pages, sections=None, rendered=False):
+        """Return @pages loaded like Page.load does (arguments have the
+        same meaning) in a fixed number of queries no matter how many pages
+        are loaded. @pages can be Page instances or ids, missing ids are
+        skipped and order is kept."""
+        pages = list(pages)
+        ids = [page for page in pages if not isinstance(page, Page)]
+        if ids:
+            found = self.select_related('path').in_bulk(ids)
+            pages = [page if isinstance(page, Page) else found[page]
+                        for page in pages
+                            if isinstance(page, Page) or page in found]
+        pending = [page for page in pages if not page._loaded]
+        if not pending:
+            return pages
+
+        sections = sections_filter(sections)
+        grouped = defaultdict(list)
+        if rendered:
+            qs = Rendered.objects.filter(page__in=[page.id for page in pending],
+                                         version=F('page__rendered_version'))
+            if sections:
+                qs = qs.filter(sections)
+            for page_id, name, value in qs.values_list('page', 'name',
+                                                       'value'):
+                grouped[page_id].append((name, value))
+            shared = set(name for page in pending
+                                for name in page.tpl.shared_sections())
+            shared = shared and SharedSection.content(list(shared))
+            for page in pending:
+                page._load_rendered(grouped[page.id], shared)
+        else:
+            lineages = self.lineages(pending)
+            ids = set(page_id for lineage in lineages.itervalues()
+                                for page_id in lineage)
+            qs = Value.objects.filter(page__in=ids)
+            if sections:
+                qs = qs.filter(sections)
+            for row in qs.values_list('page', 'name', 'type', 'value',
+                                      'cleared'):
+                grouped[row[0]].append(row)
+            for page in pending:
+                lineage = lineages[page.id]
+                page._load_values(resolve_values(lineage,
+                        (row for page_id in lineage
+                                for row in grouped[page_id])))
+        return pages
+
+    def lineages(self, pages):
+        """Return dictionary of page ids and their lineage (see
+        Page.lineage) for @pages, base pages are fetched a level at a
+        time."""
+        bases = dict((page.id, page.base_id) for page in pages)
+        missing = set(bases.itervalues()) - set(bases) - set([None])
+        while missing:
+            rows = list(self.filter(pk__in=missing).values_list('id', 'base'))
+            bases.update(rows)
+            missing = set(base for page_id, base in rows) - set(bases) - \
+                            set([None])
+
+        lineages = {}
+        for page in pages:
+            ids, base = [page.id], page.base_id
+            while base is not None and base not in ids and base in bases:
+                ids.append(base)
+                base = bases[base]
+            lineages[page.id] = ids
+        return lineages
+
+
 class Page(models.Model):
     """A CMS Page"""
     path = models.ForeignKey(Path, related_name='pages', verbose_name='URL')
@@ -82,6 +223,19 @@ class Page(models.Model):
     state = models.CharField(max_length=20, default=WIP, choices=STATES)
     description = models.TextField(blank=True)
     updated = models.DateTimeField(editable=False, auto_now_add=True)
+    # page this one was copied from, values not overriden are read from it
+    base = models.ForeignKey('self', null=True, blank=True, editable=False,
+                             related_name='derived',
+                             on_delete=models.SET_NULL)
+    # rendered content set served for this page
+    rendered_version = models.PositiveIntegerField(default=0, editable=False)
+    # last rendered version allocated, see next_version
+    last_version = models.PositiveIntegerField(default=0, editable=False)
+    # scheduled publishing, see tcms_scheduler management command
+    publish_at = models.DateTimeField(null=True, blank=True, db_index=True,
+                                      help_text='Publish page at this time')
+    unpublish_at = models.DateTimeField(null=True, blank=True, db_index=True,
+                                    help_text='Unpublish page at this time')
 
     # metadata
     meta_title = models.CharField(max_length=1024, blank=True, default='',
@@ -97,11 +251,18 @@ class Page(models.Model):
     search_text = models.TextField(blank=True, default='',
                            help_text='Description displayed on search results')
 
+    objects = PageManager()
+
     def __init__(self, *args, **kwargs):
         super(Page, self).__init__(*args, **kwargs)
         self._loaded = False
         self._rendered = False
         self._template = None
+        self._description = self.__dict__.get('description') \
+                                if self.id else ''
+        self._saved_state = self.__dict__.get('state') if self.id else None
+        self._saved_path_id = self.__dict__.get('path_id') \
+                                if self.id else None
 
     @property
     def thumbnail(self):
@@ -110,10 +271,30 @@ class Page(models.Model):
         return self.search_image
 
     def save(self, *args, **kwargs):
-        """Save handler, will ensure that only one WIP exists per path"""
+        """Save handler, will ensure that only one WIP exists per path
+        and keeps path live and WIP pointers in sync with page state"""
         if not self.id:
             Page.validate_unique_wip(self.path)
         super(Page, self).save(*args, **kwargs)
+        if (self.state, self.path_id) != (self._saved_state,
+                                          self._saved_path_id):
+            self.update_path_pointers()
+        if self.description != self._description:
+            from tcms.search import index_description
+            index_description(self)
+            self._description = self.description
+
+    def update_path_pointers(self):
+        """Point path live or WIP page to this page, pointers to it from
+        previous state or path are cleared."""
+        if self._saved_state in POINTERS:
+            field = POINTERS[self._saved_state]
+            Path.objects.filter(pk=self._saved_path_id, **{field: self.id})\
+                        .update(**{field: None})
+        if self.state in POINTERS:
+            Path.objects.filter(pk=self.path_id)\
+                        .update(**{POINTERS[self.state]: self.id})
+        self._saved_state, self._saved_path_id = self.state, self.path_id
 
     @classmethod
     def validate_unique_wip(cls, path):
@@ -141,35 +322,106 @@ class Page(models.Model):
             If @rendered flag is passed, only rendered data is loaded
         """
         if not self._loaded:
-            if sections:
-                if not isinstance(sections, (list, tuple)):
-                    sections = (sections,)
-                sections = reduce(or_, (Q(name__startswith=section)
-                                            for section in sections))
-
-            self._rendered = rendered
+            sections = sections_filter(sections)
             if rendered: # load rendered content
-                qs = self.rendered_data.values_list('name', 'value')
+                qs = self.active_rendered().values_list('name', 'value')
                 if sections:
                     qs = qs.filter(sections)
-                for name, value in qs:
-                    setattr(self, name, mark_safe(value))
+                shared = self.tpl.shared_sections()
+                self._load_rendered(qs, shared and SharedSection.content(shared))
             else: # load values
-                qs = self.values.values_list('name', 'value')
-                if sections:
-                    qs = qs.filter(sections)
-                self.tpl.load(qs)
-            self._loaded = True
+                self._load_values(self.effective_values(sections))
+
+    def _load_rendered(self, values, shared=None):
+        """Set rendered content from (name, value) pairs in @values, current
+        @shared sections content dictionary is set over them"""
+        for name, value in values:
+            setattr(self, name, mark_safe(value))
+        for name in self.tpl.shared_sections():
+            if shared and name in shared: # always current shared content
+                setattr(self, name, mark_safe(shared[name]))
+        self._rendered = self._loaded = True
+
+    def _load_values(self, values):
+        """Load (name, type, value) triplets in @values into template"""
+        self.tpl.load((name, value) for name, type, value in values)
+        self._rendered, self._loaded = False, True
+
+    def lineage(self):
+        """Return ids of this page and the pages it's based on, nearest
+        first. Values are looked up following this order."""
+        ids, base = [self.id], self.base_id
+        while base is not None and base not in ids:
+            ids.append(base)
+            base = Page.objects.values_list('base', flat=True).get(pk=base)
+        return ids
+
+    def effective_values(self, sections=None):
+        """Return (name, type, value) triplets of values visible in this
+        page. Own values override the ones inherited from base pages and
+        cleared values are left out. @sections is an optional Q filter.
+        """
+        lineage = self.lineage()
+        qs = Value.objects.filter(page__in=lineage)
+        if sections:
+            qs = qs.filter(sections)
+        return resolve_values(lineage, qs.values_list('page', 'name', 'type',
+                                                      'value', 'cleared'))
+
+    @transaction.commit_on_success
+    def clear_values(self, basename):
+        """Clear values under @basename. Values inherited from base pages
+        are masked with cleared entries, base pages are left untouched."""
+        self.detach_derived((name, type) for name, type, value in
+                                self.effective_values(
+                                        Q(name__startswith=basename)))
+        self.values.filter(name__startswith=basename).delete()
+        if self.base_id:
+            names = Q(name__startswith=basename)
+            for name, type, value in self.base.effective_values(names):
+                self.values.create(name=name, type=type, cleared=True)
+
+    def detach_derived(self, fields):
+        """Hand values of (name, type) @fields as this page sees them down
+        to pages based on it which don't override them, must be called
+        before changing them here so copies keep their content. Names not
+        visible in this page are masked with cleared values."""
+        fields = dict(fields)
+        derived = list(self.derived.values_list('id', flat=True))
+        if not fields or not derived:
+            return
+        current = dict((name, (type, value)) for name, type, value in
+                            self.effective_values(Q(name__in=fields.keys())))
+        own = set(Value.objects.filter(page__in=derived,
+                                       name__in=fields.keys())\
+                               .values_list('page', 'name'))
+        for page_id in derived:
+            for name, type in fields.iteritems():
+                if (page_id, name) not in own:
+                    type, value = current.get(name, (type, ''))
+                    Value.objects.create(page_id=page_id, name=name,
+                                         type=type, value=value,
+                                         cleared=name not in current)
 
     @property
     def is_live(self):
         """Return True if page is in Live state or False in other case"""
         return self.state == LIVE
 
-    def refresh(self, *args, **kwargs):
-        """Refresh rendered data, subsections are rendered by page template
-        sections and stored. Extra arguments will be passed to section
-        rendering method.
+    def active_rendered(self):
+        """Return rendered content rows of the version served, the version
+        is read in the same query so rows dropped by a concurrent refresh
+        are never looked up"""
+        return self.rendered_data.filter(version=F('page__rendered_version'))
+
+    def render(self, *args, **kwargs):
+        """Render subsections by page template sections and store them as a
+        new rendered version which isn't served until activated, rows are
+        written in a single batch. Optional @progress callable is called
+        with sections done and total count. If @sections names are passed
+        only those are rendered and the rest are copied from the version
+        served. Extra arguments will be passed to section rendering method.
+        Returns the new version number.
         """
         extra_context = kwargs.pop('extra_context', {})
 
@@ -179,34 +431,221 @@ class Page(models.Model):
         extra_context['cms'] = self
         kwargs['extra_context'] = extra_context
 
+        progress = kwargs.pop('progress', None)
+        sections = kwargs.get('sections')
+
         self.load()
-        for name, value in self.tpl.render_sections(*args, **kwargs):
-            obj, created = Rendered.objects.get_or_create(page=self, name=name)
-            obj.value = value
-            obj.save()
+        version = self.next_version()
+        total, rows = len(sections or self.tpl), []
+        for done, (name, value) in enumerate(
+                            self.tpl.iter_render_sections(*args, **kwargs)):
+            rows.append((self.id, version, name, value,
+                         self.tpl[name].fingerprint()))
+            if progress:
+                progress(done + 1, total)
+        if sections:
+            rows.extend((self.id, version, name, value, fingerprint)
+                            for name, value, fingerprint in
+                                self.active_rendered()\
+                                    .exclude(name__in=sections)\
+                                    .values_list('name', 'value',
+                                                 'fingerprint'))
+        insert_many(Rendered, ('page_id', 'version', 'name', 'value',
+                               'fingerprint'), rows)
+        return version
+
+    def next_version(self):
+        """Allocate a new rendered version number, concurrent renders of the
+        page never get the same one. Versions rendered before the counter
+        existed are skipped."""
+        while True:
+            last = Page.objects.values_list('last_version', flat=True)\
+                               .get(pk=self.id)
+            version = max(last, self.rendered_data.aggregate(
+                                        last=Max('version'))['last'] or 0) + 1
+            allocated = Page.objects.filter(pk=self.id, last_version=last)\
+                                    .update(last_version=version)
+            transaction.commit_unless_managed()
+            if allocated:
+                self.last_version = version
+                return version
+
+    def refresh(self, *args, **kwargs):
+        """Refresh rendered data, a new version is rendered and then served.
+        Arguments will be passed to section rendering method.
+        """
+        version = self.render(*args, **kwargs)
+        self._activate(version)
+        self.drop_stale_rendered()
+        self.touch_includes()
+        if self.is_live:
+            self.update_search_index()
+            self.touch_snapshot()
 
     @transaction.commit_on_success
+    def _activate(self, version):
+        """Serve rendered @version, see _advance_version"""
+        return self._advance_version(version)
+
+    def _advance_version(self, version):
+        """Serve rendered @version unless a newer one is served already,
+        versions only move forward. Returns True if @version is served."""
+        advanced = Page.objects.filter(pk=self.id,
+                                       rendered_version__lt=version)\
+                               .update(rendered_version=version)
+        self.rendered_version = self._served_version()
+        return bool(advanced)
+
+    def _served_version(self):
+        """Return rendered version stored as served for this page"""
+        return Page.objects.values_list('rendered_version', flat=True)\
+                           .get(pk=self.id)
+
+    def drop_stale_rendered(self):
+        """Delete rendered versions older than the one actually served,
+        newer ones might be being rendered."""
+        self.rendered_data.filter(version__lt=self._served_version()).delete()
+        transaction.commit_unless_managed()
+
     def publish(self, *args, **kwargs):
         """Publish page, will generate rendered content and unpublish current
         live page with same path and state.
 
-        Arguments will be passed to refresh method which will be passed to
+        Content is rendered to a new version out of any transaction, then
+        the new version and live state are switched in a short one.
+
+        Arguments will be passed to render method which will be passed to
         rendering method.
         """
-        similar = {'path': self.path, 'state': LIVE}
-        for page in Page.objects.filter(**similar):
-            page.unpublish()
+        self._publish(*args, **kwargs)
+        update_cache()
+
+    def _publish(self, *args, **kwargs):
+        """Publish page without updating routing cache"""
+        version = self.render(*args, **kwargs)
+        previous = self._swap_live(version)
+        self._published(previous)
+
+    def _published(self, previous):
+        """Clean up after publishing, @previous is the page replaced"""
+        self.drop_stale_rendered()
+        if previous is not None:
+            previous.update_search_index()
+            previous.touch_sitemap()
+            previous.touch_includes()
+            previous.touch_navigation()
+            previous.touch_snapshot()
+        self.update_search_index()
+        self.touch_sitemap()
+        self.touch_includes()
+        self.touch_navigation()
+        self.touch_snapshot()
 
-        self.refresh(*args, **kwargs)
+    @transaction.commit_on_success
+    def _swap_live(self, version):
+        """Make page live serving rendered @version in its own transaction,
+        see _make_live"""
+        return self._make_live(version)
+
+    def _make_live(self, version):
+        """Unpublish current live page for path and make this one live
+        serving rendered @version. Returns unpublished page if any. No
+        transaction is handled here, callers are responsible of it."""
+        live = Path.objects.filter(pk=self.path_id)\
+                           .values_list('live_page', flat=True)[0]
+        previous = None
+        if live is not None and live != self.id:
+            previous = Page.objects.get(pk=live)
+            previous.state = OLD
+            previous.save()
         self.state = LIVE
+        self.rendered_version = self._served_version()
+        self.publish_at = None
         self.save()
-        update_cache()
+        self._advance_version(version)
+        return previous
 
     def unpublish(self):
         """Unpublish page, rendered content is not droped"""
+        self._unpublish()
+        update_cache()
+
+    def _unpublish(self):
+        """Unpublish page without updating routing cache"""
         self.state = OLD
+        self.unpublish_at = None
         self.save()
-        update_cache()
+        self.update_search_index()
+        self.touch_sitemap()
+        self.touch_includes()
+        self.touch_navigation()
+        self.touch_snapshot()
+
+    def update_search_index(self):
+        """Index page content if it's live, remove it from index if not"""
+        from tcms.search import index_page, unindex_page
+        if self.is_live:
+            index_page(self)
+        else:
+            unindex_page(self)
+
+    def touch_sitemap(self):
+        """Drop cached sitemap chunk containing this page"""
+        from tcms.sitemap import touch
+        touch(self.id)
+
+    def touch_includes(self):
+        """Drop page sections cached for {% cms_include %} tags"""
+        cache.delete(includes_key(self.id))
+
+    def touch_navigation(self):
+        """Add page to cached navigation tree if it's live or remove it"""
+        from tcms.navigation import update
+        update(self)
+
+    def touch_snapshot(self):
+        """Store JSON delivery snapshot if page is live or drop it"""
+        from tcms.api import update
+        update(self)
+
+    @classmethod
+    def included_sections(cls, ids):
+        """Return dictionary of page ids and dictionaries of their rendered
+        sections, used by {% cms_include %} tags. Sections are cached per
+        page until it's published, refreshed or unpublished, shared
+        sections content is always current. Only live pages sections are
+        included, other pages get no sections."""
+        keys = dict((includes_key(page_id), page_id) for page_id in ids)
+        found = dict((keys[key], value)
+                        for key, value in cache.get_many(keys.keys()).items())
+        missing = [page_id for page_id in keys.values()
+                            if page_id not in found]
+        if missing:
+            live = Page.objects.select_related('path')\
+                               .filter(pk__in=missing, state=LIVE)
+            for page in Page.objects.load_many(live, rendered=True):
+                shared = page.tpl.shared_sections()
+                found[page.id] = dict((name, page.__dict__[name])
+                                        for name in page.tpl.keys()
+                                            if name in page.__dict__ and
+                                               name not in shared)
+                found[page.id][None] = shared
+                cache.set(includes_key(page.id), found[page.id])
+            for page_id in missing:
+                if page_id not in found: # not live, nothing to include
+                    found[page_id] = {None: []}
+                    cache.set(includes_key(page_id), found[page_id])
+
+        shared = set(name for sections in found.itervalues()
+                            for name in sections[None])
+        if shared:
+            shared = SharedSection.content(list(shared))
+        result = {}
+        for page_id, sections in found.iteritems():
+            result[page_id] = dict(sections)
+            for name in result[page_id].pop(None):
+                result[page_id][name] = mark_safe(shared.get(name, ''))
+        return result
 
     @transaction.commit_on_success
     def delete(self):
@@ -214,17 +653,38 @@ class Page(models.Model):
         and values are deleted too"""
         if self.state == LIVE:
             raise TypeError('live pages cannot be deleted')
+        self.release_derived()
         self.rendered_data.all().delete()
         self.values.all().delete()
         super(Page, self).delete()
         update_cache()
 
+    def release_derived(self):
+        """Hand own values down to pages based on this one, which are
+        rebased on this page base so they keep seeing the same values.
+        The last derived page takes the rows, the rest get copies."""
+        derived = list(self.derived.all())
+        for pos, page in enumerate(derived):
+            own = set(page.values.values_list('name', flat=True))
+            for value in self.values.all():
+                if value.name not in own:
+                    if pos < len(derived) - 1:
+                        value.id = None
+                    value.page = page
+                    value.save()
+            page.base_id = self.base_id
+            page.save()
+
     @transaction.commit_on_success
     def copy(self, path):
         """Return copy of this page.
 
         Copies current page under a new @path. This method behaves like
         cloning if path is the same as current one.
+
+        Values are not duplicated, the copy is based on this page and only
+        values edited on it are stored. Copies deeper than COPY_MAX_DEPTH
+        get their values materialized to keep loading cheap.
         """
         args = {'path': path,
                 'template': self.template,
@@ -235,19 +695,21 @@ class Page(models.Model):
                 'search_image': self.search_image,
                 'search_text': self.search_text}
         copy = Page(**args)
-        copy.save()
-
-        # duplicate values
-        for value in self.values.all():
-            value.id = None
-            copy.values.add(value)
-
+        if len(self.lineage()) < COPY_MAX_DEPTH:
+            copy.base = self
+            copy.save()
+        else:
+            copy.save()
+            for name, type, value in self.effective_values():
+                copy.values.add(Value(name=name, type=type, value=value))
         return copy
 
-    def to_xml(self, out, encoding=settings.DEFAULT_CHARSET):
+    def to_xml(self, out, encoding=settings.DEFAULT_CHARSET, known=None):
         """Exports page data in a XML formated file. It stores
         page info as first item and value data following it.
-        Files are base64 encoded and exported too.
+        Files are base64 encoded and exported too, except those which
+        content checksum is in @known list, only the checksum is exported
+        for them since the target already has the content.
 
         Example:
         <cms-page>
@@ -272,7 +734,12 @@ class Page(models.Model):
                 'meta_description': self.meta_description,
                 'meta_keywords': self.meta_keywords,
                 'search_text': self.search_text}
-        if self.search_image: # add image content if any
+        known = set(known or ())
+        checksum = file_checksum(self.search_image) if known else None
+        if checksum and checksum in known:
+            data['search_image_name'] = self.search_image.name
+            data['search_image_checksum'] = checksum
+        elif self.search_image: # add image content if any
             img = image_to_b64(self.search_image)
             if img is not None:
                 name, content = img
@@ -283,12 +750,17 @@ class Page(models.Model):
         xml.endElement('page')
 
         # store values
-        values = self.values.values_list('name', 'type', 'value')
-        for name, value_type, value in values:
+        for name, value_type, value in self.effective_values():
             attrs = {'name': name, 'type': value_type, 'value': value}
 
             if value_type in TYPES_MAP:
-                attrs.update(TYPES_MAP[value_type]().to_xml(value))
+                Type = TYPES_MAP[value_type]
+                checksum = Type().checksum(value) \
+                                if known and issubclass(Type, Image) else None
+                if checksum and checksum in known:
+                    attrs['checksum'] = checksum
+                else:
+                    attrs.update(Type().to_xml(value))
             xml.startElement('value', attrs)
             xml.endElement('value')
 
@@ -331,6 +803,19 @@ class Page(models.Model):
         else:
             Page.validate_unique_wip(path)
 
+        # check that images exported without content are present
+        storage = Page._meta.get_field('search_image').storage
+        root = upload_root(IMAGES_UPLOAD_TO)
+        missing = [(attr.get('checksum'), attr.get('value'))
+                        for attr in (node.attrib for node in etree[1:])
+                            if 'checksum' in attr and 'file_name' not in attr]
+        if 'search_image_checksum' in page_info:
+            missing.append((page_info['search_image_checksum'],
+                            page_info.get('search_image_name')))
+        for checksum, name in missing:
+            if not hashed_lookup(checksum, name, storage, root):
+                raise ValidationError('Missing image content for %s' % name)
+
     @classmethod
     def from_xml(cls, source):
         """Import a page information. @source must be an XML exported
@@ -356,9 +841,17 @@ class Page(models.Model):
         page.save()
 
         # save search image if any
-        save_b64_image(page_info.get('search_image'),
-                       page_info.get('search_image_name'),
-                       page.search_image, save=True)
+        if 'search_image_checksum' in page_info:
+            page.search_image = hashed_lookup(
+                                    page_info['search_image_checksum'],
+                                    page_info.get('search_image_name'),
+                                    page.search_image.storage,
+                                    upload_root(IMAGES_UPLOAD_TO))
+            page.save()
+        else:
+            save_b64_image(page_info.get('search_image'),
+                           page_info.get('search_image_name'),
+                           page.search_image, save=True)
 
         # values are from second child to end
         for node in etree[1:]:
@@ -394,12 +887,20 @@ class Value(models.Model):
            value name
     @value is store database value
     @type  is data type name
+    @cleared marks a value inherited from a base page as removed
     """
     page = models.ForeignKey(Page, related_name='values')
     name = models.CharField(max_length=255)
     value = models.TextField(blank=True)
     type = models.CharField(max_length=32, choices=((name, Type.description)
                                     for name, Type in TYPES_MAP.iteritems()))
+    cleared = models.BooleanField(default=False)
+
+    def save(self, *args, **kwargs):
+        """Save handler, keeps content terms index updated"""
+        super(Value, self).save(*args, **kwargs)
+        from tcms.search import index_value
+        index_value(self)
 
     def __unicode__(self):
         return u'%s (%s)' % (self.name, self.value[:20])
@@ -408,11 +909,250 @@ class Value(models.Model):
         unique_together = ('page', 'name')
 
 
+class ContentTerm(models.Model):
+    """Content index entry used by admin searches, values and pages
+    descriptions are split in terms, terms for descriptions have no value.
+    """
+    term = models.CharField(max_length=64, db_index=True)
+    page = models.ForeignKey(Page, related_name='content_terms')
+    value = models.ForeignKey(Value, null=True, related_name='terms')
+
+
+class SearchTerm(models.Model):
+    """Search index entry, live pages content is split in terms which are
+    stored with their weight on the page.
+    @locale is page path locale, used to filter results by locale
+    """
+    term = models.CharField(max_length=64, db_index=True)
+    page = models.ForeignKey(Page, related_name='search_terms')
+    locale = models.CharField(max_length=255, blank=True, default='')
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('term', 'page')
+
+
+class ImageVariant(models.Model):
+    """Responsive width variant of an uploaded CMS image
+    @original is the image name as stored in values
+    @width    is variant width in pixels
+    @name     is variant file name
+    """
+    original = models.CharField(max_length=255, db_index=True)
+    width = models.PositiveIntegerField()
+    name = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('original', 'width')
+
+
 class Rendered(models.Model):
-    """CMS Page rendered content for rapid page loading"""
+    """CMS Page rendered content for rapid page loading. Each publish or
+    refresh renders a new version, page rendered_version is the one served.
+    """
     page = models.ForeignKey(Page, related_name='rendered_data')
+    version = models.PositiveIntegerField(default=0)
     name = models.CharField(max_length=64, blank=False)
     value = models.TextField()
+    # section fingerprint when rendered, see tcms.tpl.Section.fingerprint
+    fingerprint = models.CharField(max_length=40, blank=True, default='')
 
     class Meta:
-        unique_together = ('page', 'name')
+        unique_together = ('page', 'version', 'name')
+
+
+class Job(models.Model):
+    """Background job run by tcms_worker management command, see tcms.jobs"""
+    kind = models.CharField(max_length=20, choices=JOB_KINDS)
+    page = models.ForeignKey(Page, null=True, blank=True, related_name='jobs')
+    state = models.CharField(max_length=20, default=PENDING,
+                             choices=JOB_STATES, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    progress = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True, default='')
+    # space separated sections names to refresh, all if empty
+    sections = models.TextField(blank=True, default='')
+    run_after = models.DateTimeField(default=datetime.now, db_index=True)
+    started = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    @property
+    def lateness(self):
+        """Return seconds the job started after it was due"""
+        if self.started:
+            delta = self.started - self.run_after
+            return max(delta.days * 86400 + delta.seconds, 0)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.get_kind_display(), self.page_id or '')
+
+    class Meta:
+        ordering = ('run_after', 'id')
+
+
+class Release(models.Model):
+    """Bundle of pages published or rolled back as a unit"""
+    name = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    state = models.CharField(max_length=20, default=OPEN,
+                             choices=RELEASE_STATES)
+    created = models.DateTimeField(auto_now_add=True)
+    released = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def publish(self, *args, **kwargs):
+        """Publish release pages. Pages are rendered first out of any
+        transaction, then all of them are made live in a single one and
+        routing cache is updated once at the end. Arguments will be passed
+        to pages render method."""
+        if self.state != OPEN:
+            raise ValidationError('Release "%s" was already published' % self)
+        items = list(self.items.select_related('page'))
+        if any(item.page.state != WIP for item in items):
+            raise ValidationError('Only "Work in progress" pages can be '
+                                  'released')
+        versions = [item.page.render(*args, **kwargs) for item in items]
+        self._swap_live(items, versions)
+        for item in items:
+            item.page._published(item.replaced)
+        update_cache()
+
+    @transaction.commit_on_success
+    def _swap_live(self, items, versions):
+        """Make @items pages live serving their rendered @versions, pages
+        replaced are recorded for rollback"""
+        for item, version in zip(items, versions):
+            item.replaced = item.page._make_live(version)
+            item.save()
+        self.state = RELEASED
+        self.released = datetime.now()
+        self.save()
+
+    def rollback(self):
+        """Unpublish release pages and bring back the pages they replaced,
+        pages replaced since then by other publishes are left untouched.
+        Routing cache is updated once at the end."""
+        if self.state != RELEASED:
+            raise ValidationError('Release "%s" is not published' % self)
+        changed = self._rollback()
+        for page in changed:
+            page.update_search_index()
+            page.touch_sitemap()
+            page.touch_includes()
+            page.touch_navigation()
+            page.touch_snapshot()
+        update_cache()
+
+    @transaction.commit_on_success
+    def _rollback(self):
+        """Switch pages states back, returns pages changed"""
+        changed = []
+        for item in self.items.select_related('page', 'replaced'):
+            page = item.page
+            if page.state != LIVE:
+                continue
+            page.state = OLD
+            page.save()
+            changed.append(page)
+            if item.replaced is not None and item.replaced.state == OLD:
+                item.replaced.state = LIVE
+                item.replaced.save()
+                changed.append(item.replaced)
+        self.state = ROLLED_BACK
+        self.save()
+        return changed
+
+    def __unicode__(self):
+        return self.name
+
+
+class ReleaseItem(models.Model):
+    """Release page and the live page it replaced when released"""
+    release = models.ForeignKey(Release, related_name='items')
+    page = models.ForeignKey(Page, related_name='release_items')
+    replaced = models.ForeignKey(Page, null=True, blank=True, editable=False,
+                                 related_name='+', on_delete=models.SET_NULL)
+
+    class Meta:
+        unique_together = ('release', 'page')
+
+
+class SharedSection(models.Model):
+    """Content of a shared section (see tcms.tpl.Shared), values are edited
+    and content rendered once for every page including it. @section is
+    the dotted path of the Section class used."""
+    name = models.CharField(max_length=64, unique=True)
+    section = models.CharField(max_length=255, editable=False)
+    rendered = models.TextField(blank=True, default='', editable=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def get_for(cls, name, section_class):
+        """Return shared section @name, it's created if missing"""
+        path = '%s.%s' % (section_class.__module__, section_class.__name__)
+        shared, created = cls.objects.get_or_create(name=name,
+                                                    defaults={'section': path})
+        return shared
+
+    @classmethod
+    def content(cls, names):
+        """Return dictionary of rendered content for shared sections
+        @names, content is read from cache if possible"""
+        keys = dict((_shared_key(name), name) for name in names)
+        found = dict((keys[key], value)
+                        for key, value in cache.get_many(keys.keys()).items())
+        missing = [name for name in names if name not in found]
+        if missing:
+            for name, value in cls.objects.filter(name__in=missing)\
+                                          .values_list('name', 'rendered'):
+                cache.set(_shared_key(name), value)
+                found[name] = value
+        return found
+
+    def load_section(self):
+        """Return Section instance loaded with shared values"""
+        module, class_name = self.section.rsplit('.', 1)
+        section = getattr(import_module(module), class_name)()
+        section.basename = self.name
+        section.load((split_basename(name, 1)[1], value)
+                        for name, value in self.values.filter(cleared=False)\
+                                                      .values_list('name',
+                                                                   'value')
+                            if SEP in name)
+        return section
+
+    def refresh(self):
+        """Render content again, returns rendered content"""
+        self.rendered = self.load_section().render({'shared': self})
+        self.save()
+        cache.set(_shared_key(self.name), self.rendered)
+        return self.rendered
+
+    def clear_values(self, basename):
+        """Clear values under @basename and render content again"""
+        self.values.filter(name__startswith=basename).delete()
+        self.refresh()
+
+    def __unicode__(self):
+        return self.name
+
+
+class SharedValue(models.Model):
+    """Shared section value, see Value"""
+    shared = models.ForeignKey(SharedSection, related_name='values')
+    name = models.CharField(max_length=255)
+    type = models.CharField(max_length=32, choices=((name, Type.description)
+                                    for name, Type in TYPES_MAP.iteritems()))
+    value = models.TextField(blank=True)
+    cleared = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('shared', 'name')
+
+
+def includes_key(page_id):
+    return '%s-include-%s' % (CACHE_NAME, page_id)
+
+
+def _shared_key(name):
+    return '%s-shared-%s' % (CACHE_NAME, name)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Navigation tree of live pages. The tree is materialized from pages paths
+for each locale, it's a dictionary of paths and nodes cached as a whole and
+updated on publish and unpublish. Every ancestor of a page path is present
+in the tree, paths without a live page get nodes with no id.
+
+Nodes are dictionaries with path, id, title and children paths keys.
+Trees are kept in process memory too and read again from cache once
+NAVIGATION_TTL seconds have passed, they are shared and must not be
+changed by callers."""
+import time
+from bisect import insort
+
+from django.conf import settings
+from django.core.cache import cache
+
+from tcms.utils import CACHE_NAME, is_pattern
+
+
+NAVIGATION_TIMEOUT = getattr(settings, 'TCMS_NAVIGATION_TIMEOUT',
+                             60 * 60 * 24)
+# seconds trees are kept in process memory before being read from cache
+NAVIGATION_TTL = getattr(settings, 'TCMS_NAVIGATION_TTL', 30)
+# seconds a tree update lock is held at most
+LOCK_TIMEOUT = 10
+ROOT = '/'
+
+# in-process trees by locale and the time they were loaded
+_trees = {}
+
+
+def tree(locale=''):
+    """Return navigation tree for @locale, it's kept in process memory and
+    loaded from cache once NAVIGATION_TTL seconds have passed or built if
+    not cached"""
+    nodes, loaded = _trees.get(locale or '', (None, 0))
+    if nodes is None or time.time() - loaded > NAVIGATION_TTL:
+        nodes = cache.get(_key(locale))
+        if nodes is None:
+            nodes = build(locale)
+        else:
+            _trees[locale or ''] = (nodes, time.time())
+    return nodes
+
+
+def build(locale=''):
+    """Build navigation tree for @locale from live pages, it's cached
+    unless a tree update is running, which might be missing from it"""
+    from tcms.models import Path
+
+    nodes = {ROOT: _node(ROOT)}
+    paths = Path.objects.filter(locale=locale, live_page__isnull=False)\
+                        .values_list('path', 'live_page',
+                                     'live_page__meta_title')
+    for path, page_id, title in paths:
+        if not is_pattern(path):
+            _add(nodes, path, page_id, title)
+    key = _key(locale)
+    if cache.add(key + '-lock', True, LOCK_TIMEOUT):
+        try:
+            cache.set(key, nodes, NAVIGATION_TIMEOUT)
+        finally:
+            cache.delete(key + '-lock')
+    _trees[locale or ''] = (nodes, time.time())
+    return nodes
+
+
+def update(page):
+    """Update cached navigation tree with @page, added if it's live or
+    removed otherwise. Nothing is done if the tree isn't cached, it will
+    be built when needed. Updates hold a lock in cache, if it's taken by
+    another process the tree is dropped instead of losing changes."""
+    path, locale = page.path.path, page.path.locale
+    if is_pattern(path):
+        return
+    key = _key(locale)
+    _trees.pop(locale or '', None)
+    if not cache.add(key + '-lock', True, LOCK_TIMEOUT):
+        cache.delete(key)
+        return
+    try:
+        nodes = cache.get(key)
+        if nodes is None:
+            return
+        if page.is_live:
+            _add(nodes, path, page.id, page.meta_title)
+        elif path in nodes and nodes[path]['id'] == page.id:
+            _remove(nodes, path)
+        else:
+            return
+        cache.set(key, nodes, NAVIGATION_TIMEOUT)
+        _trees[locale or ''] = (nodes, time.time())
+    finally:
+        cache.delete(key + '-lock')
+
+
+def breadcrumbs(path, locale=''):
+    """Return nodes from root to @path"""
+    nodes, crumbs = tree(locale), []
+    while path is not None:
+        if path in nodes:
+            crumbs.append(nodes[path])
+        path = parent_path(path)
+    crumbs.reverse()
+    return crumbs
+
+
+def children(path, locale=''):
+    """Return @path children nodes"""
+    nodes = tree(locale)
+    if path in nodes:
+        return [nodes[child] for child in nodes[path]['children']]
+    return []
+
+
+def siblings(path, locale=''):
+    """Return nodes sharing parent with @path, @path node included"""
+    parent = parent_path(path)
+    return children(parent, locale) if parent is not None else []
+
+
+def parent_path(path):
+    """Return parent of normalized @path, None for root path
+    >>> parent_path('/a/b/')
+    '/a/'
+    >>> parent_path('/a/')
+    '/'
+    """
+    if path == ROOT:
+        return None
+    return path[:path.rstrip('/').rfind('/') + 1]
+
+
+def _add(nodes, path, page_id, title):
+    """Add or update @path node, missing ancestors are created"""
+    if path in nodes:
+        nodes[path].update(id=page_id, title=title or _title(path))
+        return
+    nodes[path] = _node(path, page_id, title)
+    parent = parent_path(path)
+    if parent not in nodes:
+        _add(nodes, parent, None, None)
+    insort(nodes[parent]['children'], path)
+
+
+def _remove(nodes, path):
+    """Remove @path node, it's kept with no id if it has children. Ancestors
+    left with no id and no children are removed too."""
+    while path != ROOT and not nodes[path]['children']:
+        parent = parent_path(path)
+        del nodes[path]
+        nodes[parent]['children'].remove(path)
+        path = parent
+        if nodes[path]['id'] is not None:
+            return
+    nodes[path]['id'] = None
+
+
+def _node(path, page_id=None, title=None):
+    return {'path': path, 'id': page_id, 'title': title or _title(path),
+            'children': []}
+
+
+def _title(path):
+    """Default title, last path segment"""
+    return path.rstrip('/').rsplit('/', 1)[-1].replace('-', ' ').title()
+
+
+def _key(locale):
+    return '%s-nav-%s' % (CACHE_NAME, locale or '')
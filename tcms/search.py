@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Full text search over live pages content. Pages are split in terms when
+published and the terms are stored with their weight in an inverted index
+(SearchTerm model), pages are removed from the index when unpublished.
+
+Admin searches use a second index (ContentTerm model) over every value and
+page description, updated each time they are saved.
+"""
+from math import log
+from collections import defaultdict
+
+from django.db.models import Count
+
+from tcms.models import Page, Value, SearchTerm, ContentTerm, LIVE, \
+                        COPY_MAX_DEPTH
+from tcms.utils import tokenize, insert_many, locale_tags
+
+
+# weight of page fields terms, rendered content terms weight 1
+FIELDS_WEIGHT = (('meta_title', 5), ('meta_keywords', 3),
+                 ('meta_description', 2), ('search_text', 2))
+
+
+def index_page(page):
+    """Index @page rendered content and metadata, previous entries for the
+    page are replaced."""
+    weights = defaultdict(int)
+    for field, weight in FIELDS_WEIGHT:
+        for term in tokenize(getattr(page, field)):
+            weights[term] += weight
+    for value in page.active_rendered().values_list('value', flat=True):
+        for term in tokenize(value, html=True):
+            weights[term] += 1
+
+    unindex_page(page)
+    insert_many(SearchTerm, ('term', 'page_id', 'locale', 'weight'),
+                [(term, page.id, page.path.locale, weight)
+                    for term, weight in weights.iteritems()])
+
+
+def unindex_page(page):
+    """Remove @page entries from index"""
+    SearchTerm.objects.filter(page=page).delete()
+
+
+def search(query, locale=None, limit=20):
+    """Return live pages containing every word in @query sorted by
+    relevance, up to @limit pages. Ranking is weighted term frequency by
+    inverse page frequency. If @locale is passed only pages for that locale
+    or it's parent locales are returned. Pages come with path loaded and
+    have a score attribute, use their search_text and thumbnail to display
+    results."""
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    qs = SearchTerm.objects.filter(term__in=terms)
+    if locale is not None:
+        qs = qs.filter(locale__in=locale_tags(locale))
+
+    postings = defaultdict(dict)
+    for term, page_id, weight in qs.values_list('term', 'page', 'weight'):
+        postings[term][page_id] = weight
+    if len(postings) < len(terms): # some word has no match
+        return []
+
+    total = Page.objects.filter(state=LIVE).count()
+    pages = reduce(set.intersection, (set(entries)
+                                        for entries in postings.itervalues()))
+    scores = defaultdict(float)
+    for term, entries in postings.iteritems():
+        idf = log(1 + float(total) / len(entries))
+        for page_id in pages:
+            scores[page_id] += (1 + log(entries[page_id])) * idf
+
+    ranked = sorted(scores, key=lambda page_id: -scores[page_id])[:limit]
+    found = Page.objects.select_related('path').in_bulk(ranked)
+    result = []
+    for page_id in ranked:
+        if page_id in found:
+            found[page_id].score = scores[page_id]
+            result.append(found[page_id])
+    return result
+
+
+def index_value(value):
+    """Index @value content, previous entries for the value are replaced"""
+    ContentTerm.objects.filter(value=value).delete()
+    if not value.cleared:
+        insert_many(ContentTerm, ('term', 'page_id', 'value_id'),
+                    [(term, value.page_id, value.id)
+                        for term in set(tokenize(value.value, html=True))])
+
+
+def index_description(page):
+    """Index @page description, previous entries are replaced"""
+    ContentTerm.objects.filter(page=page, value__isnull=True).delete()
+    insert_many(ContentTerm, ('term', 'page_id'),
+                [(term, page.id) for term in set(tokenize(page.description))])
+
+
+def search_values(phrase, after=None, limit=100):
+    """Return ids of values containing @phrase, newest first. Candidates
+    having every word are taken from the content index and checked for
+    the whole phrase. Results are paginated by keyset, @after is the last
+    id returned by previous call."""
+    words = tokenize(phrase)
+    if not words:
+        return []
+    result = []
+    while len(result) < limit:
+        qs = ContentTerm.objects.filter(term__in=set(words),
+                                        value__isnull=False)
+        if after is not None:
+            qs = qs.filter(value__lt=after)
+        window = [row['value'] for row in
+                    qs.values('value').annotate(matches=Count('term'))\
+                      .filter(matches=len(set(words))).order_by('-value')\
+                      [:limit]]
+        texts = dict(Value.objects.filter(pk__in=window)\
+                                  .values_list('id', 'value'))
+        result += [value_id for value_id in window
+                        if _has_phrase(texts.get(value_id), words)]
+        if len(window) < limit:
+            break
+        after = window[-1]
+    return result[:limit]
+
+
+def search_pages(phrase, limit=100):
+    """Return ids of pages containing @phrase in their values or
+    description. Pages based on a page with a matching value are included
+    too when they inherit the value, that is they have no value of their
+    own with its name."""
+    words = tokenize(phrase)
+    if not words:
+        return []
+    value_ids = search_values(phrase, limit=limit)
+    level = set(Value.objects.filter(pk__in=value_ids)\
+                             .values_list('page', 'name'))
+    ids = set(page_id for page_id, name in level)
+
+    qs = ContentTerm.objects.filter(term__in=set(words), value__isnull=True)
+    candidates = [row['page'] for row in
+                    qs.values('page').annotate(matches=Count('term'))\
+                      .filter(matches=len(set(words)))[:limit]]
+    ids.update(page_id for page_id, text in
+                    Page.objects.filter(pk__in=candidates)\
+                                .values_list('id', 'description')
+                        if _has_phrase(text, words))
+
+    for depth in range(COPY_MAX_DEPTH):
+        names = defaultdict(set)
+        for page_id, name in level:
+            names[page_id].add(name)
+        derived = Page.objects.filter(base__in=names.keys())\
+                              .values_list('id', 'base')
+        level = set((page_id, name) for page_id, base_id in derived
+                                        for name in names[base_id])
+        if not level:
+            break
+        # derived pages values override inherited ones
+        level -= set(Value.objects.filter(page__in=[p for p, n in level],
+                                          name__in=set(n for p, n in level))\
+                                  .values_list('page', 'name'))
+        ids.update(page_id for page_id, name in level)
+    return list(ids)
+
+
+def _has_phrase(text, words):
+    """Return True if @words appear consecutively in @text"""
+    tokens, size = tokenize(text, html=True), len(words)
+    return any(tokens[pos:pos + size] == words
+                    for pos in range(len(tokens) - size + 1))
@@ -1,37 +1,62 @@
+import time
+from bisect import bisect_left
+
+from django.conf import settings
 from django.contrib import sitemaps
 from django.core import urlresolvers
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger
 from models import Page, LIVE
+from utils import CACHE_NAME, WILDCARD
+
+# pages per sitemap file and cache timeout for chunks
+SITEMAP_LIMIT = getattr(settings, 'TCMS_SITEMAP_LIMIT', 5000)
+SITEMAP_TIMEOUT = getattr(settings, 'TCMS_SITEMAP_TIMEOUT', 60 * 60 * 24)
+BOUNDS_KEY = CACHE_NAME + '-sitemap'
+
 
 class TCMSSitemap(sitemaps.Sitemap):
     """Return the sitemap items from CMS"""
+    limit = SITEMAP_LIMIT
+
     def __init__(self, patterns=None, priority=None, changefreq=None):
         """
         patterns is list of url patterns to find CMS pages for. Should have "name" param defined
-        when patterns are ommited all live cms pages are used
-        
+        when patterns are ommited all live cms pages are used, split in fixed size chunks
+
         priority and changefreq allows to define eponymous params in resulting sitemap
         """
-        
+
         if hasattr(patterns, "__iter__"):
-            self.patterns = [pattern.name for pattern in patterns 
+            self.patterns = [pattern.name for pattern in patterns
                 if hasattr(pattern, 'name') and pattern.name]
         else:
             self.patterns = None
+        self._urls = None
 
         self.priority = priority
         self.changefreq = changefreq
 
     def items(self):
-        pages = Page.objects.select_related('path').filter(state = LIVE)
+        pages = live_pages()
 
         if self.patterns != None:
-            urls = map(urlresolvers.reverse, self.patterns)
-            urls = [url + '/' if not url.endswith('/') else url for url in urls]
-            
-            pages = list(pages.filter(path__path__in = urls))
-            
+            if self._urls is None: # reverse names just once
+                urls = map(urlresolvers.reverse, self.patterns)
+                self._urls = [url + '/' if not url.endswith('/') else url for url in urls]
+
+            pages = list(pages.filter(path__path__in = self._urls))
+
         return pages
-        
+
+    @property
+    def paginator(self):
+        """All live pages are paginated by id ranges, patterns are
+        paginated by django default paginator"""
+        if self.patterns != None:
+            return super(TCMSSitemap, self).paginator
+        return KeysetPaginator(self.limit)
+
 
     def changefreq(self, obj):
         return self.changefreq
@@ -43,4 +68,92 @@ class TCMSSitemap(sitemaps.Sitemap):
         return obj.updated
 
     def location(self, obj):
-        return str(obj.path)
\ No newline at end of file
+        return str(obj.path)
+
+
+class KeysetPaginator(object):
+    """Paginates live pages over page id ranges. Ranges upper bounds are
+    found walking ids every @limit pages and cached, chunks are fetched
+    by id range and cached until a publish touches them, so there are no
+    offsets nor counts on sitemap requests."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.generation, self.bounds = _bounds(limit)
+
+    @property
+    def num_pages(self):
+        return len(self.bounds) + 1
+
+    def page(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1 or number > self.num_pages:
+            raise EmptyPage('That page contains no results')
+        return Chunk(self, number)
+
+
+class Chunk(object):
+    """Sitemap chunk, object_list is loaded from cache if possible"""
+    def __init__(self, paginator, number):
+        self.paginator = paginator
+        self.number = number
+
+    @property
+    def object_list(self):
+        key = _chunk_key(self.paginator.generation, self.number)
+        pages = cache.get(key)
+        if pages is None:
+            bounds = self.paginator.bounds
+            qs = live_pages().order_by('id')
+            if self.number > 1:
+                qs = qs.filter(id__gt=bounds[self.number - 2])
+            if self.number <= len(bounds):
+                qs = qs.filter(id__lte=bounds[self.number - 1])
+            pages = list(qs)
+            cache.set(key, pages, SITEMAP_TIMEOUT)
+            if len(pages) > self.paginator.limit: # trailing chunk outgrew
+                cache.delete(BOUNDS_KEY)          # limit, split it again
+        return pages
+
+
+def live_pages():
+    """Return live pages queryset, pattern paths are left out since they
+    aren't URLs"""
+    return Page.objects.select_related('path').filter(state=LIVE)\
+                       .exclude(path__path__contains=WILDCARD)
+
+
+def touch(*page_ids):
+    """Drop cached sitemap chunks containing @page_ids, call it when pages
+    are published or unpublished."""
+    data = cache.get(BOUNDS_KEY)
+    if data is not None:
+        generation, bounds = data
+        cache.delete_many([_chunk_key(generation, bisect_left(bounds, id) + 1)
+                                for id in page_ids])
+
+
+def _bounds(limit):
+    """Return generation and cached list of chunks upper bounds, bounds
+    are computed if not cached."""
+    data = cache.get(BOUNDS_KEY)
+    if data is None:
+        qs = live_pages().order_by('id').values_list('id', flat=True)
+        bounds, last = [], 0
+        while True:
+            ids = list(qs.filter(id__gt=last)[limit - 1:limit])
+            if not ids:
+                break
+            last = ids[0]
+            bounds.append(last)
+        if bounds and not qs.filter(id__gt=bounds[-1]).exists():
+            bounds.pop() # avoid an empty trailing chunk
+        data = (int(time.time() * 1000), bounds)
+        cache.set(BOUNDS_KEY, data, SITEMAP_TIMEOUT)
+    return data
+
+
+def _chunk_key(generation, number):
+    return '%s-%s-%s' % (BOUNDS_KEY, generation, number)
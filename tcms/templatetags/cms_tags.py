@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 from operator import add
 
-from django.template import Library
+from django.core.cache import cache
+from django.template import Library, Node, TemplateSyntaxError
+from django.utils import translation
+from django.utils.encoding import force_unicode
+from django.utils.safestring import mark_safe
 
-from tcms.models import Path, WIP, LIVE
+from tcms import navigation
+from tcms.models import Path, Page, WIP, LIVE
+from tcms.tpl import Shared
+from tcms.utils import CACHE_NAME, LOCALIZED, ids_from_cache, \
+                       normalize_path
 
 
 register = Library()
@@ -22,3 +30,160 @@ def similar_pages(page):
                              for path in Path.objects.filter(path=page.path.path)))
     else:
         return []
+
+
+def _nav_args(page, locale=None):
+    """Return path and locale to look up in navigation tree, @page is a
+    Page instance or a path. Paths are looked up in @locale tree, active
+    language on localized sites by default."""
+    if isinstance(page, basestring):
+        if locale is None:
+            locale = translation.get_language() if LOCALIZED else ''
+        return normalize_path(page), locale
+    return page.path.path, page.path.locale
+
+
+@register.filter
+def nav_breadcrumbs(page, locale=None):
+    return navigation.breadcrumbs(*_nav_args(page, locale)) if page else []
+
+
+@register.filter
+def nav_children(page, locale=None):
+    return navigation.children(*_nav_args(page, locale)) if page else []
+
+
+@register.filter
+def nav_siblings(page, locale=None):
+    return navigation.siblings(*_nav_args(page, locale)) if page else []
+
+
+class SectionNode(Node):
+    def __init__(self, name, timeout=None, vary_locale=None):
+        self.name = name
+        self.timeout = timeout
+        self.vary_locale = vary_locale
+
+    def render(self, context):
+        page = context.get('cms')
+        if page is None:
+            return ''
+        name = self.name.resolve(context)
+        section = page.tpl[name]
+        timeout = section.CACHE_TIMEOUT if self.timeout is None \
+                        else self.timeout.resolve(context)
+        # previews are never cached, shared sections are cached on their own
+        # and change without pages being published
+        if not timeout or not page.is_live or isinstance(section, Shared):
+            return force_unicode(page[name])
+
+        vary_locale = section.CACHE_VARY_LOCALE if self.vary_locale is None \
+                            else self.vary_locale
+        key = '%s-section-%s-%s-%s-%s' % (CACHE_NAME, page.id,
+                                          page.rendered_version,
+                                          'r' if page._rendered else 'v',
+                                          name)
+        if vary_locale:
+            key += '-' + translation.get_language()
+        out = cache.get(key)
+        if out is None:
+            out = force_unicode(page[name])
+            cache.set(key, out, int(timeout))
+        return mark_safe(out)
+
+
+@register.tag
+def cms_section(parser, token):
+    """Render a section of current CMS page caching the fragment for the
+    section CACHE_TIMEOUT seconds, timeout and locale variation can be
+    overridden in the tag. Fragments of a page are dropped when it's
+    published or refreshed, until then values edited show up once the
+    timeout expires. Shared sections aren't cached by the tag.
+
+    Usage:
+        {% cms_section "heading" %}
+        {% cms_section "news" 60 %}
+        {% cms_section "news" 60 vary_locale %}
+    """
+    bits = token.split_contents()
+    if not 2 <= len(bits) <= 4 or \
+       (len(bits) == 4 and bits[3] not in ('vary_locale', 'no_vary_locale')):
+        raise TemplateSyntaxError('Usage: {%% %s "name" [timeout] '
+                                  '[vary_locale|no_vary_locale] %%}' % bits[0])
+    name = parser.compile_filter(bits[1])
+    timeout = parser.compile_filter(bits[2]) if len(bits) > 2 else None
+    vary_locale = (bits[3] == 'vary_locale') if len(bits) > 3 else None
+    return SectionNode(name, timeout, vary_locale)
+
+
+class IncludeNode(Node):
+    """Includes a section of another page. Targets of every include node
+    in a template are resolved together on the first one rendered."""
+    def __init__(self, target, section, batch):
+        self.target = target
+        self.section = section
+        self.batch = batch
+        batch.append(self)
+
+    def render(self, context):
+        target = self.target.resolve(context, True)
+        section = self.section.resolve(context, True)
+        if not target or not section:
+            return ''
+
+        key = ('cms_include', id(self.batch))
+        content = context.render_context.get(key)
+        if content is None: # first include rendered, resolve all of them
+            content = context.render_context[key] = {}
+            targets = set(node.target.resolve(context, True)
+                                for node in self.batch)
+        else:
+            targets = set()
+        if target not in content: # target depends on a loop variable
+            targets.add(target)
+        targets.discard(None)
+        targets.discard('')
+        if targets:
+            content.update(_included(targets, translation.get_language()))
+        return mark_safe((content[target] or {}).get(section, ''))
+
+
+def _included(targets, locale):
+    """Return dictionary of @targets (Page instances, page ids or paths)
+    and their rendered sections, None for targets without a page"""
+    ids, paths = {}, []
+    for target in targets:
+        if isinstance(target, Page):
+            ids[target] = target.id
+        elif isinstance(target, (int, long)) or \
+             (isinstance(target, basestring) and target.isdigit()):
+            ids[target] = int(target)
+        else:
+            paths.append(target)
+    ids.update(ids_from_cache(paths, locale))
+    sections = Page.included_sections(set(ids.values()))
+    return dict((target, sections.get(ids.get(target)))
+                    for target in targets)
+
+
+@register.tag
+def cms_include(parser, token):
+    """Include a section rendered content of another CMS page, pages are
+    referenced by path, id or instance. Every include in a template is
+    resolved in a single batch and sections are cached per page until it's
+    published again.
+
+    Usage:
+        {% cms_include "/about/" "heading" %}
+        {% cms_include 42 "image" %}
+        {% cms_include item.url "title" %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise TemplateSyntaxError('Usage: {%% %s target "section" %%}' % \
+                                                                    bits[0])
+    batch = getattr(parser, '_cms_includes', None)
+    if batch is None:
+        batch = parser._cms_includes = []
+    return IncludeNode(parser.compile_filter(bits[1]),
+                       parser.compile_filter(bits[2]), batch)
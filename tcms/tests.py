@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from tcms.bloom import BloomFilter
+from tcms.data_types import Text
+from tcms.forms import DynamicForm
+from tcms.models import Path, Page, SharedSection, resolve_values
+from tcms.tpl import Section, Shared, Single
+from tcms.utils import compile_patterns, match_pattern
+
+
+class Footer(Section):
+    NAME = 'Footer'
+    DESCRIPTION = 'Footer text'
+
+    def set_fields(self):
+        self['text'] = Single(text=Text())
+
+    def render(self, extra_context=None):
+        return unicode(self['text'])
+
+
+class SharedSectionTest(TestCase):
+    def save(self, text):
+        section = Shared(Footer)
+        section.basename = 'footer'
+        return section.save(None, 'text', {'basename': 'footer/text',
+                                           'text': text})
+
+    def test_save_creates_shared_value(self):
+        self.save(u'First')
+        shared = SharedSection.objects.get(name='footer')
+        self.assertEqual(list(shared.values.values_list('value', flat=True)),
+                         [u'First'])
+        self.assertEqual(shared.rendered, u'First')
+
+    def test_save_updates_shared_value(self):
+        self.save(u'First')
+        self.save(u'Second')
+        shared = SharedSection.objects.get(name='footer')
+        self.assertEqual(list(shared.values.values_list('value', flat=True)),
+                         [u'Second'])
+
+
+class CopyValuesTest(TestCase):
+    def setUp(self):
+        self.page = self.create_page('/a/')
+        self.save_value(self.page, 'text', u'Original')
+        self.copy = self.page.copy(Path.objects.create(path='/b/'))
+
+    def create_page(self, path):
+        return Page.objects.create(path=Path.objects.create(path=path),
+                                   template='testpage')
+
+    def save_value(self, page, name, text):
+        form = DynamicForm([(name, Text())], {'basename': 'heading/text',
+                                              name: text})
+        self.assertTrue(form.is_valid())
+        return form.save(page)
+
+    def value(self, page, name='heading/text/text'):
+        return dict((name, value) for name, type, value in
+                        page.effective_values()).get(name)
+
+    def test_copy_sees_base_values(self):
+        self.assertEqual(self.value(self.copy), u'Original')
+
+    def test_edit_base_keeps_copy(self):
+        self.save_value(self.page, 'text', u'Changed')
+        self.assertEqual(self.value(self.page), u'Changed')
+        self.assertEqual(self.value(self.copy), u'Original')
+
+    def test_edit_base_keeps_copy_of_copy(self):
+        copy = self.copy.copy(Path.objects.create(path='/c/'))
+        self.save_value(self.page, 'text', u'Changed')
+        self.assertEqual(self.value(copy), u'Original')
+
+    def test_value_added_to_base_is_not_copied(self):
+        self.save_value(self.page, 'title', u'New')
+        self.assertEqual(self.value(self.page, 'heading/text/title'), u'New')
+        self.assertEqual(self.value(self.copy, 'heading/text/title'), None)
+
+    def test_clear_base_keeps_copy(self):
+        self.page.clear_values('heading')
+        self.assertEqual(self.value(self.page), None)
+        self.assertEqual(self.value(self.copy), u'Original')
+
+    def test_edit_copy_keeps_base(self):
+        self.save_value(self.copy, 'text', u'Changed')
+        self.assertEqual(self.value(self.copy), u'Changed')
+        self.assertEqual(self.value(self.page), u'Original')
+
+
+class PatternMatchTest(TestCase):
+    def setUp(self):
+        self.trie = compile_patterns({'/a/*/': {'': 1}, '/a/b/': {'': 2},
+                                      '/a/**': {'': 3}, '/*/b/c/': {'': 4},
+                                      '/**': {'': 5, 'en': 6}})
+
+    def match(self, path, locales=('',)):
+        return match_pattern(self.trie, path, locales)
+
+    def test_exact_segment_preferred(self):
+        self.assertEqual(self.match('/a/b/'), 2)
+
+    def test_single_segment_wildcard(self):
+        self.assertEqual(self.match('/a/x/'), 1)
+        self.assertEqual(self.match('/x/b/c/'), 4)
+
+    def test_rest_wildcard(self):
+        self.assertEqual(self.match('/a/x/y/'), 3)
+        self.assertEqual(self.match('/a/b/c/'), 3)
+        self.assertEqual(self.match('/x/y/'), 5)
+
+    def test_locales_order(self):
+        self.assertEqual(self.match('/x/', ('en-gb', 'en', '')), 6)
+        self.assertEqual(self.match('/x/', ('de', '')), 5)
+        self.assertEqual(self.match('/x/', ('de',)), None)
+
+    def test_root_never_matches(self):
+        self.assertEqual(self.match('/'), None)
+        self.assertEqual(self.match(''), None)
+
+
+class BloomFilterTest(TestCase):
+    def setUp(self):
+        self.paths = [u'/page-%d/' % pos for pos in range(1000)]
+        self.filter = BloomFilter(self.paths, 0.01)
+
+    def test_members(self):
+        for path in self.paths:
+            self.assertTrue(path in self.filter)
+        self.assertTrue('/page-1/' in self.filter)
+
+    def test_size(self):
+        self.assertEqual(self.filter.size, 9586)
+        self.assertEqual(self.filter.hashes, 7)
+        self.assertEqual(len(self.filter.bits), 1199)
+        self.assertEqual(self.filter.count, 1000)
+
+    def test_false_positives(self):
+        found = sum(1 for pos in range(10000)
+                        if u'/other-%d/' % pos in self.filter)
+        self.assertTrue(found < 300)
+        self.assertTrue(self.filter.false_positive_rate() < 0.02)
+
+    def test_empty(self):
+        paths = BloomFilter([])
+        self.assertFalse('/' in paths)
+        self.assertEqual(paths.count, 0)
+
+
+class ResolveValuesTest(TestCase):
+    def resolve(self, lineage, rows):
+        return sorted(resolve_values(lineage, rows))
+
+    def test_nearest_page_wins(self):
+        rows = [(3, 'a', 'text', u'base', False),
+                (2, 'a', 'text', u'copy', False),
+                (3, 'b', 'text', u'inherited', False)]
+        self.assertEqual(self.resolve([1, 2, 3], rows),
+                         [('a', 'text', u'copy'),
+                          ('b', 'text', u'inherited')])
+
+    def test_cleared_values_hide_base_values(self):
+        rows = [(2, 'a', 'text', u'base', False),
+                (1, 'a', 'text', u'', True)]
+        self.assertEqual(self.resolve([1, 2], rows), [])
+
+    def test_values_cleared_in_base_are_set_again(self):
+        rows = [(3, 'a', 'text', u'base', False),
+                (2, 'a', 'text', u'', True),
+                (1, 'a', 'text', u'copy', False)]
+        self.assertEqual(self.resolve([1, 2, 3], rows),
+                         [('a', 'text', u'copy')])
+
+
+class LineagesTest(TestCase):
+    def create_page(self, path, base=None):
+        return Page.objects.create(path=Path.objects.create(path=path),
+                                   template='testpage', base=base)
+
+    def test_chain(self):
+        first = self.create_page('/a/')
+        second = self.create_page('/b/', first)
+        third = self.create_page('/c/', second)
+        self.assertEqual(Page.objects.lineages([third]),
+                         {third.id: [third.id, second.id, first.id]})
+
+    def test_cycle_stops(self):
+        first = self.create_page('/a/')
+        second = self.create_page('/b/', first)
+        Page.objects.filter(pk=first.pk).update(base=second)
+        pages = list(Page.objects.filter(pk__in=[first.pk, second.pk]))
+        self.assertEqual(Page.objects.lineages(pages),
+                         {first.id: [first.id, second.id],
+                          second.id: [second.id, first.id]})
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 """Template definition base classes and build structures."""
 import re
+import hashlib
+import inspect
 from os import walk, sep
 from os.path import dirname
 from collections import defaultdict
 
 from django.conf import settings
-from django.template import loader, Context
+from django.template import loader, Context, TemplateDoesNotExist
 from django.utils.datastructures import SortedDict
 from django.utils.safestring import mark_safe
 from django.utils.importlib import import_module
@@ -18,6 +20,8 @@ from tcms.exceptions import TemplateFormValidationError
 
 RENDER_EXTRA_CONTEXT = getattr(settings, 'TCMS_RENDER_EXTRA_CONTEXT', {})
 SEP = '/'
+# sections render fingerprints by class and template name
+FINGERPRINTS = {}
 
 class Page(SortedDict):
     """
@@ -175,8 +179,29 @@ class Page(SortedDict):
         """Return a list of section names and rendered content.
         Rendering is delegated to each section and arguments are passed
         directly."""
-        return [(name, section.render(*args, **kwargs))
-                    for name, section in self.iteritems()]
+        return list(self.iter_render_sections(*args, **kwargs))
+
+    def iter_render_sections(self, *args, **kwargs):
+        """Yield section names and rendered content one section at a time,
+        see render_sections. Only sections named in @sections keyword
+        argument are rendered if it's passed."""
+        sections = kwargs.pop('sections', None)
+        for name, section in self.iteritems():
+            if isinstance(section, Shared): # rendered on their own
+                continue
+            if not sections or name in sections:
+                yield name, section.render(*args, **kwargs)
+
+    def fingerprints(self):
+        """Return dictionary of section names and render fingerprints"""
+        return dict((name, section.fingerprint())
+                        for name, section in self.iteritems()
+                            if not isinstance(section, Shared))
+
+    def shared_sections(self):
+        """Return names of shared sections"""
+        return [name for name, section in self.iteritems()
+                        if isinstance(section, Shared)]
 
 
 class Section(SortedDict):
@@ -194,6 +219,10 @@ class Section(SortedDict):
     DESCRIPTION = ''    # section description
     basename = None     # section basename (used to store values in database)
     page = None
+    # {% cms_section %} fragment cache seconds (not cached if not set) and
+    # cache a fragment per active language flag
+    CACHE_TIMEOUT = None
+    CACHE_VARY_LOCALE = False
 
     def __init__(self):
         """Init method. Defines basename as class name if not defined."""
@@ -257,6 +286,115 @@ class Section(SortedDict):
         out = loader.get_template(self.template).render(Context(context))
         return mark_safe(out or '')
 
+    def fingerprint(self):
+        """Return a hash of what rendered content depends on, the section
+        template source, the section class definition and the extra render
+        context (names and primitive values only). Rendered content with a
+        different fingerprint is stale.
+        Templates included or extended by the section template are not
+        taken into account."""
+        template = getattr(self, 'template', None)
+        key = (self.__class__, template)
+        if key not in FINGERPRINTS:
+            try:
+                source = inspect.getsource(self.__class__)
+            except (IOError, TypeError):
+                source = self.__class__.__name__
+            sha = hashlib.sha1(source)
+            if template: # sections overriding render might have none
+                sha.update(template_source(template))
+            sha.update(_stable_repr(RENDER_EXTRA_CONTEXT))
+            FINGERPRINTS[key] = sha.hexdigest()
+        return FINGERPRINTS[key]
+
+
+class Shared(Section):
+    """Shared section wrapper. Content of a shared section is the same on
+    every page defining a Shared section with the same name, values are
+    stored and content rendered once in a SharedSection model instance
+    and pages pick changes up without being published again.
+
+    Usage:
+        self['footer'] = Shared(Footer)
+    """
+    def __init__(self, section_class):
+        self.section_class = section_class
+        super(Shared, self).__init__()
+        self.NAME = section_class.NAME
+        self.DESCRIPTION = section_class.DESCRIPTION
+        self.CACHE_TIMEOUT = section_class.CACHE_TIMEOUT
+        self.CACHE_VARY_LOCALE = section_class.CACHE_VARY_LOCALE
+        self._shared = None
+
+    def set_fields(self):
+        """Fields are defined by the wrapped section"""
+        pass
+
+    @property
+    def shared(self):
+        """Return SharedSection instance storing this section content"""
+        if self._shared is None:
+            from tcms.models import SharedSection
+            self._shared = SharedSection.get_for(self.basename,
+                                                 self.section_class)
+        return self._shared
+
+    def load(self, values):
+        """Page values are ignored, shared values are loaded on demand"""
+        pass
+
+    def inc_form(self):
+        return self.shared.load_section().inc_form()
+
+    def save(self, page, basename, *args, **kwargs):
+        """Save values in shared section and render it again"""
+        shared = self.shared
+        result = shared.load_section().save(shared, basename, *args, **kwargs)
+        shared.refresh()
+        return result
+
+    def done_percent(self):
+        return self.shared.load_section().done_percent()
+
+    def __nonzero__(self):
+        return bool(self.shared.load_section())
+
+    def render(self, extra_context=None):
+        """Return shared section rendered content"""
+        from tcms.models import SharedSection
+        content = SharedSection.content([self.basename]).get(self.basename)
+        if content is None:
+            content = self.shared.refresh()
+        return mark_safe(content)
+
+
+def _stable_repr(context):
+    """Return a representation of @context that doesn't change between
+    processes, only primitive values are included since other objects
+    repr usually carries memory addresses"""
+    primitive = (basestring, int, long, float, bool, type(None))
+    return repr(sorted((key, value if isinstance(value, primitive) else None)
+                            for key, value in context.iteritems()))
+
+
+def template_source(name, loaders=None):
+    """Return source of template @name, empty string if not found"""
+    if loaders is None:
+        loaders = filter(None, map(loader.find_template_loader,
+                                   settings.TEMPLATE_LOADERS))
+    for template_loader in loaders:
+        if hasattr(template_loader, 'loaders'): # cached loader
+            source = template_source(name, template_loader.loaders)
+            if source:
+                return source
+            continue
+        try:
+            source, origin = template_loader.load_template_source(name)
+        except (TemplateDoesNotExist, NotImplementedError):
+            continue
+        return source.encode('utf-8')
+    return ''
+
 
 class FieldSet(object):
     """
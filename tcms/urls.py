@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from django.conf.urls.defaults import patterns, url
+
+
+urlpatterns = patterns('tcms.api',
+    url(r'^page/$', 'page', name='tcms_api_page'),
+)
@@ -1,20 +1,46 @@
 # -*- coding: utf-8 -*-
+import os
 import re
+import time
 import base64
-from os.path import split
+import hashlib
+from os.path import split, splitext
 from cStringIO import StringIO
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import connection, transaction
+from django.db.models import Q
 from django.db.models.fields.files import ImageFieldFile
 from django.utils.datastructures import DotExpandedDict
+from django.utils.encoding import force_unicode
+from django.utils.html import strip_tags
+
+from tcms.bloom import BloomFilter
 
 
 CACHE_NAME = getattr(settings, 'TCMS_CACHE_NAME', 'tcms')
+# routing cache and paths filter keys, versioned since their format changed
+ROUTES_KEY = CACHE_NAME + '-v2'
+PATH_FILTER_KEY = CACHE_NAME + '-filter-v2'
+LOCALIZED = getattr(settings, 'TCMS_LOCALIZED', False)
+# seconds the in-process CMS paths filter is trusted, disabled if not set
+PATH_FILTER_TTL = getattr(settings, 'TCMS_PATH_FILTER_TTL', None)
+PATH_FILTER_ERROR_RATE = getattr(settings, 'TCMS_PATH_FILTER_ERROR_RATE', 0.01)
+# path segments wildcards
+WILDCARD = '*'
+WILDCARD_REST = '**'
+# store images under content hash names
+IMAGES_HASHED = getattr(settings, 'TCMS_IMAGES_HASHED', False)
 
 # Capital letters regex
 CAPLETTERS = re.compile('([A-Z])')
+# Content hash file names
+HASHED_NAME = re.compile('^[0-9a-f]{40}$')
+# Words and HTML entities regexes
+WORDS = re.compile(r'\w+', re.U)
+ENTITIES = re.compile(r'&#?\w+;')
 
 def human_title(value):
     """Converts camel-case word to human readeable format."""
@@ -25,24 +51,142 @@ def human_title(value):
 
 
 def update_cache():
-    """Updates CMS pages cache, cache structure is a dictioray which key
-    is a tuple of page path, locale and state, and valud is page id."""
-    from tcms.models import Page, WIP, LIVE
+    """Updates CMS pages cache, cache structure is a dictionary which key is
+    page path (a tuple of path and requested locale on localized sites) and
+    value is the id of the page serving it. LIVE pages are preferred over WIP
+    ones and locale fallbacks are resolved here for every locale in
+    ROUTED_LOCALES, so lookups are a single probe. Pattern paths are compiled
+    into a segments trie stored under None key."""
+    from tcms.models import Path, WIP, LIVE
 
-    pages = Page.objects.filter(state__in=[WIP, LIVE]).select_related('path')
+    paths = Path.objects.filter(Q(live_page__isnull=False) |
+                                Q(wip_page__isnull=False))\
+                        .values_list('path', 'locale', 'live_page', 'wip_page')
+    found = {}
+    for path, locale, live, wip in paths:
+        if live is not None:
+            found[(path, locale, LIVE)] = live
+        if wip is not None:
+            found[(path, locale, WIP)] = wip
 
-    if getattr(settings, 'TCMS_LOCALIZED', False):
-        values = dict(((page.path.path, page.path.locale, page.state), page.id)
-                            for page in pages)
+    values, patterns = {}, {}
+    if LOCALIZED:
+        for path in set(path for path, locale, state in found):
+            for requested in ROUTED_LOCALES:
+                for loc in LOCALE_TAGS[requested]:
+                    page_id = found.get((path, loc, LIVE)) or \
+                              found.get((path, loc, WIP))
+                    if page_id is not None:
+                        if is_pattern(path):
+                            patterns.setdefault(path, {})[requested] = page_id
+                        else:
+                            values[(path, requested)] = page_id
+                        break
     else:
-        values = dict(((page.path.path, page.state), page.id)
-                            for page in pages)
-    cache.set(CACHE_NAME, values)
+        for (path, locale, state), page_id in found.iteritems():
+            if is_pattern(path):
+                if state == LIVE or path not in patterns:
+                    patterns[path] = {'': page_id}
+            elif state == LIVE or path not in values:
+                values[path] = page_id
+    trie = compile_patterns(patterns)
+    values[None] = trie
+    cache.set(ROUTES_KEY, values)
+
+    if PATH_FILTER_TTL:
+        paths = BloomFilter(set(path for path, locale, state in found
+                                    if not is_pattern(path)),
+                            PATH_FILTER_ERROR_RATE)
+        cache.set(PATH_FILTER_KEY, (paths, trie))
+        _path_filter[:] = [paths, trie, time.time()]
     return values
 
 
-def locale_tags(locale):
+# in-process CMS paths filter, patterns trie and the time they were loaded
+_path_filter = [None, None, 0]
+
+def path_filter():
+    """Return CMS paths bloom filter and patterns trie, they are kept in
+    process memory and reloaded from cache once PATH_FILTER_TTL seconds have
+    passed."""
+    paths, trie, loaded = _path_filter
+    if paths is None or time.time() - loaded > PATH_FILTER_TTL:
+        data = cache.get(PATH_FILTER_KEY)
+        if data is None:
+            update_cache()
+            paths, trie = _path_filter[:2]
+        else:
+            paths, trie = data
+            _path_filter[:] = [paths, trie, time.time()]
+    return paths, trie
+
+
+def is_pattern(path):
+    """Return True if @path has wildcard segments, '*' matches a single
+    segment and a trailing '**' matches one or more segments."""
+    return WILDCARD in path
+
+
+def compile_patterns(patterns):
+    """Compile @patterns dictionary (pattern path to locales dictionary)
+    into a trie of path segments, a path is matched in O(path length).
+    Locales dictionary is stored under None key on the pattern last node.
+    >>> compile_patterns({'/a/*/': {'': 1}})
+    {'a': {'*': {None: {'': 1}}}}
+    """
+    trie = {}
+    for path, locales in patterns.iteritems():
+        node = trie
+        for segment in path.strip('/').split('/'):
+            if segment == WILDCARD_REST: # matches the rest of the path
+                node[segment] = locales
+                break
+            node = node.setdefault(segment, {})
+        else:
+            node[None] = locales
+    return trie
+
+
+def match_pattern(trie, path, locales=('',)):
+    """Return page id for @path in patterns @trie, first locale in @locales
+    served by a matching pattern is used. Exact segments are preferred over
+    '*' and these over '**'. Root path has no segments and never matches
+    a pattern."""
+    path = normalize_path(path).strip('/')
+    return _match(trie, path.split('/') if path else [], locales)
+
+
+def _match(node, segments, locales):
+    if not segments:
+        return _locale_id(node.get(None), locales)
+    for key in (segments[0], WILDCARD):
+        if key in node:
+            page_id = _match(node[key], segments[1:], locales)
+            if page_id is not None:
+                return page_id
+    return _locale_id(node.get(WILDCARD_REST), locales)
+
+
+def _locale_id(values, locales):
+    if values:
+        for loc in locales:
+            if loc in values:
+                return values[loc]
+
+
+def _locale_tags(locale):
     """ Splits a locale/language tag into a subtags sequence
+    >>> _locale_tags('en-gb')
+    ('en-gb', 'en', '')
+    """
+    if not locale:
+        return ('',)
+    return (locale,) + _locale_tags(locale.rpartition('-')[0])
+
+
+def locale_tags(locale):
+    """ Splits a locale/language tag into a subtags sequence, tags are
+    precomputed for settings.LANGUAGES
     >>> locale_tags('en')
     ('en', '')
     >>> locale_tags('en-gb')
@@ -50,37 +194,96 @@ def locale_tags(locale):
     >>> locale_tags('')
     ('',)
     """
-    if not locale:
-        return ('',)
-    return (locale,) + locale_tags(locale.rpartition('-')[0])
+    try:
+        return LOCALE_TAGS[locale]
+    except KeyError:
+        return _locale_tags(locale)
 
 
-def id_from_cache(paths, locale=None):
-    """Load page id from cache if present. Will try locale and sub locales
-    withing LIVE and WIP states."""
-    from tcms.models import WIP, LIVE
+# subtags for each language and locales resolved when updating cache
+LOCALE_TAGS = dict((code, _locale_tags(code)) for code, name in
+                        getattr(settings, 'LANGUAGES', ()))
+ROUTED_LOCALES = set(tag for tags in LOCALE_TAGS.values() for tag in tags)
+ROUTED_LOCALES.add('')
+LOCALE_TAGS.update((tag, _locale_tags(tag)) for tag in ROUTED_LOCALES)
 
-    values = cache.get(CACHE_NAME)
-    if values is None: # load cache if not entry
-        values = update_cache()
 
+def id_from_cache(paths, locale=None):
+    """Load page id from cache if present. Locales not resolved in cache
+    are tried with their sub locales. Paths not found are matched against
+    pattern paths after that. If paths filter is enabled, paths that are
+    not CMS pages are rejected before hitting the cache."""
     if not isinstance(paths, (list, tuple)):
         paths = [paths]
+    paths = map(normalize_path, paths)
+
+    if PATH_FILTER_TTL:
+        known, trie = path_filter()
+        if not trie:
+            paths = [path for path in paths if path in known]
+            if not paths:
+                return None
+        elif not any(path in known for path in paths):
+            # patterns are matched from process memory
+            for path in paths:
+                page_id = match_pattern(trie, path,
+                                        _routed_locales(locale))
+                if page_id is not None:
+                    return page_id
+            return None
 
-    locales = locale_tags(locale)
+    values = cache.get(ROUTES_KEY)
+    if values is None: # load cache if not entry
+        values = update_cache()
+
+    locales = _routed_locales(locale)
     for path in paths: # test each path for possible locales
-        path = normalize_path(path)
-        if getattr(settings, 'TCMS_LOCALIZED', False):
+        if LOCALIZED:
             for loc in locales:
-                if (path, loc, LIVE) in values:
-                    return values[(path, loc, LIVE)]
-                elif (path, loc, WIP) in values:
-                    return values[(path, loc, WIP)]
+                if (path, loc) in values:
+                    return values[(path, loc)]
+        elif path in values:
+            return values[path]
+
+    trie = values.get(None)
+    if trie:
+        for path in paths:
+            page_id = match_pattern(trie, path, locales)
+            if page_id is not None:
+                return page_id
+
+
+def ids_from_cache(paths, locale=None):
+    """Return dictionary of @paths and the id of the page serving each one,
+    paths not served by CMS pages are left out. Routing cache is read once
+    for all paths."""
+    values = cache.get(ROUTES_KEY)
+    if values is None: # load cache if not entry
+        values = update_cache()
+
+    locales, trie, found = _routed_locales(locale), values.get(None), {}
+    for path in paths:
+        key, page_id = normalize_path(path), None
+        if LOCALIZED:
+            for loc in locales:
+                if (key, loc) in values:
+                    page_id = values[(key, loc)]
+                    break
         else:
-            if (path, LIVE) in values:
-                return values[(path, LIVE)]
-            elif (path, WIP) in values:
-                return values[(path, WIP)]
+            page_id = values.get(key)
+        if page_id is None and trie:
+            page_id = match_pattern(trie, key, locales)
+        if page_id is not None:
+            found[path] = page_id
+    return found
+
+
+def _routed_locales(locale):
+    """Return locales to probe in cache for requested @locale"""
+    if not LOCALIZED:
+        return ('',)
+    locale = locale or ''
+    return (locale,) if locale in ROUTED_LOCALES else locale_tags(locale)
 
 
 def save_b64_image(value, name, model_field, save=False):
@@ -100,7 +303,16 @@ def save_b64_image(value, name, model_field, save=False):
         data = InMemoryUploadedFile(file=sio, name=name, field_name=None,
                                     content_type=None, size=len(value),
                                     charset=None)
-        model_field.save(name, data, save=save)
+        upload_to = model_field.field.upload_to
+        if IMAGES_HASHED and isinstance(upload_to, basestring):
+            model_field.name = save_hashed(data, name, model_field.storage,
+                                           upload_root(upload_to))
+            setattr(model_field.instance, model_field.field.name,
+                    model_field.name)
+            if save:
+                model_field.instance.save()
+        else:
+            model_field.save(name, data, save=save)
         return model_field.name
 
 
@@ -118,6 +330,68 @@ def image_to_b64(model_field):
             pass
 
 
+def hashed_name(content, name, root):
+    """Return content addressed name for file @content under @root
+    directory, file extension is taken from @name."""
+    sha = hashlib.sha1()
+    for chunk in content.chunks():
+        sha.update(chunk)
+    content.seek(0)
+    digest = sha.hexdigest()
+    return '%s/%s/%s%s' % (root, digest[:2], digest, splitext(name)[1].lower())
+
+
+def save_hashed(content, name, storage, root):
+    """Saves @content under it's content addressed name in @storage, write
+    is skipped if that file already exists but it's touched so media
+    sweeper --min-age protects it. Returns stored file name."""
+    path = hashed_name(content, name, root)
+    if storage.exists(path):
+        touch_file(path, storage)
+    else:
+        path = storage.save(path, content)
+    return path
+
+
+def touch_file(name, storage):
+    """Update modification time of file @name, only for storages with
+    local files"""
+    try:
+        os.utime(storage.path(name), None)
+    except (NotImplementedError, OSError):
+        pass
+
+
+def hashed_lookup(checksum, name, storage, root):
+    """Return stored file name for content @checksum if it's present in
+    @storage, @name is used to guess file extension."""
+    if HASHED_NAME.match(checksum or ''):
+        path = '%s/%s/%s%s' % (root, checksum[:2], checksum,
+                               splitext(name or '')[1].lower())
+        if storage.exists(path):
+            touch_file(path, storage)
+            return path
+
+
+def file_checksum(model_field):
+    """Return sha1 hex digest of file content, taken from the file name if
+    it was stored content addressed. None is returned in case of error.
+    @model_field must be an django.db.models.fields.files.ImageFieldFile
+    instance.
+    """
+    if isinstance(model_field, ImageFieldFile) and model_field.name:
+        name = splitext(split(model_field.name)[-1])[0]
+        if HASHED_NAME.match(name):
+            return name
+        try:
+            sha = hashlib.sha1()
+            for chunk in model_field.chunks():
+                sha.update(chunk)
+            return sha.hexdigest()
+        except: # ignore exceptions
+            pass
+
+
 def normalize_path(path):
     """Normalize a path to be used on CMS. Basically, appends a trailing slahs"""
     path = path.strip('/')
@@ -125,6 +399,56 @@ def normalize_path(path):
     return path
 
 
+def upload_root(upload_to):
+    """Return the static leading directory of an upload_to pattern,
+    'cms/image/%Y/%m/%d' gives 'cms/image'."""
+    parts = []
+    for part in upload_to.strip('/').split('/'):
+        if '%' in part:
+            break
+        parts.append(part)
+    return '/'.join(parts)
+
+
+def iter_chunked(qs, fields, size=1000):
+    """Yield @fields tuples from @qs fetching @size rows per query, rows
+    are walked by primary key to avoid offsets on big tables."""
+    last = 0
+    while True:
+        rows = list(qs.filter(pk__gt=last).order_by('pk')\
+                      .values_list('pk', *fields)[:size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < size:
+            break
+        last = rows[-1][0]
+
+
+def tokenize(text, html=False):
+    """Return lowercased words in @text, words too short or too long to be
+    searched are left out. Tags and entities are removed if @html is set."""
+    text = force_unicode(text or '')
+    if html:
+        text = ENTITIES.sub(' ', strip_tags(text))
+    return [word for word in WORDS.findall(text.lower())
+                    if 1 < len(word) <= 64]
+
+
+def insert_many(model, fields, rows):
+    """Insert @rows for @model in a single executemany call, each row is a
+    tuple with values for @fields attribute names (use page_id for foreign
+    keys). Model save() and signals are skipped."""
+    if rows:
+        qn = connection.ops.quote_name
+        columns = dict((f.attname, f.column) for f in model._meta.fields)
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % \
+                    (qn(model._meta.db_table),
+                     ', '.join(qn(columns[name]) for name in fields),
+                     ', '.join(['%s'] * len(fields)))
+        connection.cursor().executemany(sql, rows)
+        transaction.commit_unless_managed()
+
+
 def dotted_dict_to_choices(dict_, sort=True):
     """Coverts a dotted dictionary (see DotExpandedDict class for details)
     to a recursive choices format which will be used to form <optgroup> tags
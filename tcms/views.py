@@ -14,9 +14,12 @@ from django.contrib.admin.views.main import IS_POPUP_VAR, SEARCH_VAR
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.decorators import user_passes_test
 
-from tcms.models import Page, TYPES_MAP
+from tcms.models import Page, TYPES_MAP, PUBLISH, REFRESH, UPDATE_CACHE, \
+                        PENDING, RUNNING, FAILED
 from tcms.data_types import RawIdType
+from tcms.tpl import Shared
 from tcms.forms import PageForm, CopyPageForm, ImportForm
+from tcms.jobs import enqueue, BACKGROUND_PUBLISH
 from tcms.utils import update_cache
 from tcms.exceptions import TemplateFormValidationError
 
@@ -52,6 +55,8 @@ def edit(request, page_id):
     else:
         form = PageForm(instance=page)
     state = page.get_state_display()
+    jobs = page.jobs.filter(state__in=[PENDING, RUNNING, FAILED])\
+                    .order_by('-id')[:5]
     return _render('cms/edit.html', locals(), request)
 
 
@@ -101,7 +106,10 @@ def clear(request, page_id, section):
     if request.method == 'POST':
         page = get_object_or_404(Page, pk=page_id)
         basename = request.POST['basename']
-        page.values.filter(name__startswith=basename).delete()
+        if isinstance(page.tpl[section], Shared):
+            page.tpl[section].shared.clear_values(basename)
+        else:
+            page.clear_values(basename)
         log(request, page, CHANGE, 'Content for section %s cleared' % section)
         messages.info(request, 'Content for section %s cleared' % section)
     return HttpResponseRedirect(_edit_section_url(page_id, section))
@@ -145,10 +153,14 @@ def copy(request, page_id):
 def publish(request, page_id):
     """Page publishing view"""
     page = get_object_or_404(Page, pk=page_id)
-    page.publish()
-    update_cache()
-    log(request, page, CHANGE, 'Page published')
-    messages.info(request, 'Page %s published' % page)
+    if BACKGROUND_PUBLISH:
+        enqueue(PUBLISH, page)
+        log(request, page, CHANGE, 'Page queued for publishing')
+        messages.info(request, 'Page %s queued for publishing' % page)
+    else:
+        page.publish()
+        log(request, page, CHANGE, 'Page published')
+        messages.info(request, 'Page %s published' % page)
     return HttpResponseRedirect(request.GET.get('next') or _edit_url(page_id))
 
 
@@ -157,7 +169,6 @@ def unpublish(request, page_id):
     """Page unpublishing view"""
     page = get_object_or_404(Page, pk=page_id)
     page.unpublish()
-    update_cache()
     log(request, page, CHANGE, 'Page unpublished')
     messages.info(request, 'Page %s unpublished' % page)
     return HttpResponseRedirect(request.GET.get('next') or _edit_url(page_id))
@@ -167,9 +178,14 @@ def unpublish(request, page_id):
 def refresh(request, page_id):
     """Page rendered data refreshing view"""
     page = get_object_or_404(Page, pk=page_id)
-    page.refresh()
-    log(request, page, CHANGE, 'Content refreshed')
-    messages.info(request, 'Content for page %s refreshed' % page)
+    if BACKGROUND_PUBLISH:
+        enqueue(REFRESH, page)
+        log(request, page, CHANGE, 'Content refresh queued')
+        messages.info(request, 'Content for page %s queued for refresh' % page)
+    else:
+        page.refresh()
+        log(request, page, CHANGE, 'Content refreshed')
+        messages.info(request, 'Content for page %s refreshed' % page)
     return HttpResponseRedirect(request.GET.get('next') or _edit_url(page_id))
 
 
@@ -183,17 +199,17 @@ def delete(request, page_id):
         messages.info(request, e.message)
         return HttpResponseRedirect(_edit_url(page_id))
     else:
-        update_cache()
         log(request, page, DELETION, 'Page deleted')
         messages.info(request, 'Page %s deleted' % page)
         return HttpResponseRedirect(reverse('admin:tcms_page_changelist'))
 
 
 def export(request, page_id):
-    """Page exporting view"""
+    """Page exporting view. Images which checksum is passed in "known"
+    parameters are exported without content."""
     page = get_object_or_404(Page.objects.select_related('path'), pk=page_id)
     response = HttpResponse(mimetype='application/x-download')
-    page.to_xml(response)
+    page.to_xml(response, known=request.REQUEST.getlist('known'))
     # homepage path is sluged as '', then we renamed it as 'homepage'
     name = slugify(page.path.path).replace('-', '_') or 'homepage'
     response['Content-Disposition'] = 'attachment; filename=%s.xml' % name
@@ -212,7 +228,10 @@ def import_page(request):
             except Exception, e:
                 messages.info(request, 'Impossible to import: %s' % e)
             else:
-                update_cache()
+                if BACKGROUND_PUBLISH:
+                    enqueue(UPDATE_CACHE)
+                else:
+                    update_cache()
                 log(request, page, ADDITION, 'Page imported')
                 messages.info(request, 'Page %s imported' % page)
                 return HttpResponseRedirect(_edit_url(page.id))